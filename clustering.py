@@ -0,0 +1,132 @@
+# clustering.py
+
+import numpy as np
+import pandas as pd
+
+MAX_ZOOM = 18
+CELL_BITS = 6  # Grid cells are 2^6 = 64 screen pixels wide at every zoom
+
+def mercator(lat, lon):
+    """Projects degrees to Web Mercator coordinates in [0, 1) (the tile pixel space divided by its size)."""
+    lat = np.clip(np.asarray(lat, dtype='float64'), -85.05112878, 85.05112878)
+    x = (np.asarray(lon, dtype='float64') + 180.0) / 360.0
+    sin = np.sin(np.radians(lat))
+    y = 0.5 - np.log((1 + sin) / (1 - sin)) / (4 * np.pi)
+    return np.clip(x, 0.0, np.nextafter(1.0, 0)), np.clip(y, 0.0, np.nextafter(1.0, 0))
+
+
+class ClusterIndex:
+    """
+    Zoom-aware grid clustering over a set of points.
+
+    Every point is assigned once to a cell of a fine grid at MAX_ZOOM. A cell
+    at a lower zoom is the same key shifted right by the zoom difference, so
+    the cells form a quadtree hierarchy (like supercluster's) and each zoom
+    level costs one vectorized group-by. Cells are 64 screen pixels wide at
+    every zoom, so the number of clusters drawn stays bounded by the map
+    area rather than by the number of events. Results are memoized per zoom.
+    """
+
+    def __init__(self, frame):
+        self.frame = frame.reset_index(drop=True)
+        x, y = mercator(self.frame['Latitude'].to_numpy(), self.frame['Longitude'].to_numpy())
+        scale = 1 << (MAX_ZOOM + 8 - CELL_BITS)  # 256-pixel tiles, 64-pixel cells
+        self.ix = (x * scale).astype('int64')
+        self.iy = (y * scale).astype('int64')
+        # Newest first, so each cluster's first members are its latest reports
+        self.order = self.frame['timestamp'].sort_values(ascending=False, kind='stable').index.to_numpy()
+        self._levels = {}
+
+    def __len__(self):
+        return len(self.frame)
+
+    def clusters(self, zoom, sample_size=5):
+        """
+        Returns one row per non-empty cell at `zoom`: the centroid
+        ('Latitude', 'Longitude'), 'count', and 'members' (row positions in
+        the frame of up to `sample_size` of its newest points).
+        """
+        zoom = int(min(max(zoom, 0), MAX_ZOOM))
+        if zoom not in self._levels:
+            shift = MAX_ZOOM - zoom
+            keys = ((self.ix >> shift) << 32) | (self.iy >> shift)
+            cells, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+            lat = np.bincount(inverse, weights=self.frame['Latitude'].to_numpy(), minlength=len(cells)) / counts
+            lon = np.bincount(inverse, weights=self.frame['Longitude'].to_numpy(), minlength=len(cells)) / counts
+            # Rows grouped by cell, newest first within each cell
+            ordered = self.order[np.argsort(inverse[self.order], kind='stable')]
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+            members = [ordered[start:start + min(count, sample_size)] for start, count in zip(starts, counts)]
+            self._levels[zoom] = pd.DataFrame({'Latitude': lat, 'Longitude': lon, 'count': counts, 'members': members})
+        return self._levels[zoom]
+
+def view_bounds(center, zoom, width=1200, height=500):
+    """Estimates the (south, west, north, east) box a map of `width` x `height` pixels shows at `center` and `zoom`."""
+    world = 256.0 * (1 << int(zoom))
+    x, y = mercator([center[0]], [center[1]])
+    half_w, half_h = width / 2.0 / world, height / 2.0 / world
+    north = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * max(y[0] - half_h, 0.0)))))
+    south = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * min(y[0] + half_h, 1.0)))))
+    return float(south), center[1] - half_w * 360.0, float(north), center[1] + half_w * 360.0
+
+def expand_bounds(bounds, margin=0.25):
+    """Grows a (south, west, north, east) box by `margin` of its size on every side."""
+    south, west, north, east = bounds
+    dlat, dlon = (north - south) * margin, (east - west) * margin
+    return max(south - dlat, -90.0), west - dlon, min(north + dlat, 90.0), east + dlon
+
+def contains(outer, inner):
+    """True if the (south, west, north, east) box `inner` lies within `outer`."""
+    return outer[0] <= inner[0] and outer[1] <= inner[1] and inner[2] <= outer[2] and inner[3] <= outer[3]
+
+
+class SpatialIndex:
+    """
+    Bucket index for bounding-box queries over a set of points.
+
+    Points are sorted by the key of their cell in a 2^level x 2^level Web
+    Mercator grid (row-major), so the points of one grid row's cells in a
+    longitude range are a contiguous slice found with two binary searches.
+    A query therefore costs one searchsorted per grid row it spans plus the
+    size of the result, however many points are indexed.
+    """
+
+    def __init__(self, frame, level=12):
+        self.size = 1 << level
+        lat = frame['Latitude'].to_numpy(dtype='float64')
+        lon = frame['Longitude'].to_numpy(dtype='float64')
+        x, y = mercator(lat, lon)
+        keys = (y * self.size).astype('int64') * self.size + (x * self.size).astype('int64')
+        self.order = np.argsort(keys, kind='stable')
+        self.keys = keys[self.order]
+        self.lat = lat[self.order]
+        self.lon = lon[self.order]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def query(self, south, west, north, east):
+        """Returns the sorted row positions of the points inside the box (longitudes may wrap past +/-180)."""
+        if east - west >= 360.0:
+            if south <= -90.0 and north >= 90.0:
+                return np.arange(len(self.keys))
+            west, east = -180.0, 180.0
+        elif west < -180.0 or east > 180.0:
+            west, east = (west + 180.0) % 360.0 - 180.0, (east + 180.0) % 360.0 - 180.0
+            if west > east:  # Crosses the antimeridian
+                return np.union1d(self.query(south, west, north, 180.0), self.query(south, -180.0, north, east))
+        (x0, x1), (y1, y0) = mercator([south, north], [west, east])  # y grows southwards
+        ix0, ix1 = int(x0 * self.size), int(x1 * self.size)
+        rows = np.arange(int(y0 * self.size), int(y1 * self.size) + 1, dtype='int64') * self.size
+        lo = np.searchsorted(self.keys, rows + ix0, side='left')
+        hi = np.searchsorted(self.keys, rows + ix1, side='right')
+        lengths = hi - lo
+        total = int(lengths.sum())
+        if not total:
+            return np.array([], dtype='int64')
+        # Concatenate the [lo, hi) slices without a Python loop
+        starts = np.repeat(lo - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths)
+        positions = starts + np.arange(total)
+        lat, lon = self.lat[positions], self.lon[positions]
+        inside = (lat >= south) & (lat <= north) & (lon >= west) & (lon <= east)
+        return np.sort(self.order[positions[inside]])
@@ -3,129 +3,380 @@
 import pandas as pd
 import requests
 import datetime
-import spacy
+import threading
 import numpy as np
 from geopy.geocoders import Nominatim
-from geopy.exc import GeocoderTimedOut
-from pymongo import MongoClient
+from geocoding import GeocodeCache, geocode_locations
+from ratelimit import get_limiter
+from gazetteer import Gazetteer, DEFAULT_INDEX_PATH
+from extraction import LocationExtractor
+from pipeline import Batch, Stage, run_pipeline
+from storage import bulk_upsert, ensure_indexes, find_existing_urls, link_duplicates, load_watermarks, save_watermarks
+from dedup import NearDuplicateIndex
+from db import close_client, get_client, get_disaster_collection, get_geocode_collection, get_state_collection, get_term_collection
+from rollups import term_index_built, update_term_index
+from utils import get_snapshot_dir, update_snapshot
 import streamlit as st
-import time
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-def main():
-    """Main function to run the data collection and storage process."""
-    print("--- Starting Data Collection Script ---")
-    
-    # Load credentials securely
-    try:
-        NEWSAPI_KEY = st.secrets["NEWSAPI_KEY"]
-        MONGO_URI = st.secrets["MONGO_URI"]
-        DB_NAME = st.secrets["DB_NAME"]
-        COLLECTION_NAME = st.secrets["COLLECTION_NAME"]
-    except KeyError as e:
-        print(f"!!! FATAL ERROR: Secret key not found: {e}. Check your .streamlit/secrets.toml file.")
-        return
+NEWSAPI_ENDPOINT = 'https://newsapi.org/v2/everything'
+NEWSAPI_PAGE_SIZE = 30
+DISASTER_KEYWORDS = ['earthquake', 'flood', 'tsunami', 'hurricane', 'wildfire', 'forestfire', 'tornado', 'cyclone', 'volcano', 'drought', 'landslide', 'storm', 'blizzard', 'avalanche', 'heatwave']
 
-    # Load spaCy model
-    try:
-        nlp = spacy.load("en_core_web_sm")
-        print("spaCy model loaded successfully.")
-    except OSError:
-        print("!!! FATAL ERROR: spaCy 'en_core_web_sm' model not found. Please run this command:")
-        print("python -m spacy download en_core_web_sm")
-        return
+# --- Helper Functions ---
 
-    geolocator = Nominatim(user_agent="disaster_monitor_geonews_v3")
-    NEWSAPI_ENDPOINT = 'https://newsapi.org/v2/everything'
-    disaster_keywords = ['earthquake', 'flood', 'tsunami', 'hurricane', 'wildfire', 'forestfire', 'tornado', 'cyclone', 'volcano', 'drought', 'landslide', 'storm', 'blizzard', 'avalanche', 'heatwave']
-    
-    all_articles = []
-    print("\n--- Fetching articles from NewsAPI ---")
-    for keyword in disaster_keywords:
-        print(f"   > Searching for '{keyword}'...")
+def build_http_session(pool_size, retries=3, backoff_factor=1.0):
+    """
+    Creates a keep-alive HTTP session whose connection pool is sized for
+    `pool_size` concurrent requests. Transient failures (connection errors,
+    429 and 5xx responses) are retried with exponential backoff.
+    """
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=['GET'],
+        respect_retry_after_header=True,
+        raise_on_status=False,  # Hand the last response back so raise_for_status() reports it
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def process_article(article, keyword):
+    """Maps a raw NewsAPI article onto the fields we store."""
+    return {
+        'title': article.get('title'),
+        'source': (article.get('source') or {}).get('name'),
+        'url': article.get('url'),
+        'timestamp': article.get('publishedAt'), # Use 'publishedAt' and name it 'timestamp'
+        'disaster_event': keyword.capitalize(),
+        'keyword': keyword
+    }
+
+def iter_keyword_pages(session, api_key, keyword, max_pages=1, page_size=NEWSAPI_PAGE_SIZE, timeout=15, from_time=None):
+    """
+    Yields one list of processed articles per result page for a keyword, up to
+    `max_pages` pages, optionally only those published after `from_time`.
+    Pages are requested lazily, so a busy pipeline holds off later requests.
+    """
+    for page in range(1, max_pages + 1):
         params = {
-            'apiKey': NEWSAPI_KEY, 'q': keyword, 'language': 'en', 'pageSize': 30
+            'apiKey': api_key, 'q': keyword, 'language': 'en', 'pageSize': page_size, 'page': page
         }
+        if from_time is not None:
+            params['from'] = from_time.strftime('%Y-%m-%dT%H:%M:%S')
         try:
-            response = requests.get(NEWSAPI_ENDPOINT, params=params)
+            response = session.get(NEWSAPI_ENDPOINT, params=params, timeout=timeout)
+            # NewsAPI answers 426 once a plan's result cap is reached; keep what we have.
+            if response.status_code == 426 and page > 1:
+                return
             response.raise_for_status()
-            fetched_articles = response.json().get('articles', [])
-            
-            # --- THIS IS THE KEY FIX ---
-            # Process each article to ensure it has the correct fields
-            for article in fetched_articles:
-                processed_article = {
-                    'title': article.get('title'),
-                    'source': article.get('source', {}).get('name'),
-                    'url': article.get('url'),
-                    'timestamp': article.get('publishedAt'), # Use 'publishedAt' and name it 'timestamp'
-                    'disaster_event': keyword.capitalize()
-                }
-                all_articles.append(processed_article)
-
+            payload = response.json()
         except requests.exceptions.HTTPError as e:
-            print(f"     [Error] HTTP Error for '{keyword}': {e.response.status_code}. Check your NewsAPI key.")
+            print(f"     [Error] HTTP Error for '{keyword}' (page {page}): {e.response.status_code}. Check your NewsAPI key.")
+            return
         except Exception as e:
-            print(f"     [Error] An unexpected error occurred for '{keyword}': {e}")
-            
-    if not all_articles:
-        print("\n!!! SCRIPT STOPPED: No articles were fetched from NewsAPI.")
-        return
-        
-    print(f"\nTotal articles fetched: {len(all_articles)}. Processing...")
-    
-    df = pd.DataFrame(all_articles)
-    df.dropna(subset=['title', 'timestamp', 'url'], inplace=True)
-    df.drop_duplicates(subset='title', inplace=True, keep='first')
-
-    print(f"Unique articles after cleaning: {len(df)}. Extracting locations...")
-    df['location_ner'] = df['title'].apply(lambda text: [ent.text for ent in nlp(text).ents if ent.label_ == 'GPE'])
-    df = df[df['location_ner'].apply(len) > 0]
-    df['Location'] = df['location_ner'].apply(lambda x: x[0])
-    
-    unique_locations = df['Location'].unique()
-    print(f"Found {len(unique_locations)} unique locations to geocode...")
-
-    coord_map = {}
-    for loc in unique_locations:
+            print(f"     [Error] An unexpected error occurred for '{keyword}' (page {page}): {e}")
+            return
+
+        fetched_articles = payload.get('articles', [])
+        yield [process_article(article, keyword) for article in fetched_articles]
+        if len(fetched_articles) < page_size or page * page_size >= payload.get('totalResults', 0):
+            return
+
+
+class Collector:
+    """
+    Holds everything a collection run needs: the location extractor (and its
+    spaCy model), the gazetteer, the NewsAPI session, the MongoDB client and
+    the geocode cache. Creating it pays the start-up cost once, and run() can
+    then be called any number of times, e.g. by ingest_daemon.py.
+
+    Raises KeyError for missing secrets and OSError when the spaCy model is missing.
+    """
+
+    def __init__(self, client=None):
+        self.newsapi_key = st.secrets["NEWSAPI_KEY"]
+        # One pooled client (db.py) serves every pipeline stage
+        self.owns_client = client is None
+        self.client = client or get_client()
+        self.db = self.client[st.secrets["DB_NAME"]]
+        self.collection = get_disaster_collection(self.db)
+        self.state_collection = get_state_collection(self.db)
+
+        self.gazetteer = Gazetteer.open(st.secrets.get("GAZETTEER_PATH", DEFAULT_INDEX_PATH))
+        if not self.gazetteer:
+            print("Gazetteer index not found; run 'python gazetteer.py' to build it.")
+
+        # Set up location extraction ('ner' loads the spaCy model now, 'matcher' only if it needs NER)
+        self.extractor = LocationExtractor(
+            mode=st.secrets.get("LOCATION_EXTRACTOR", "ner"),
+            gazetteer=self.gazetteer,
+            ner_fallback=bool(st.secrets.get("MATCHER_NER_FALLBACK", True)),
+            batch_size=int(st.secrets.get("NER_BATCH_SIZE", 64)),
+            n_process=int(st.secrets.get("NER_PROCESSES", 1)),
+        )
+        print(f"Location extractor ready (mode: {self.extractor.mode}).")
+
+        self.max_pages = int(st.secrets.get("NEWSAPI_MAX_PAGES", 1))
+        self.max_workers = int(st.secrets.get("NEWSAPI_MAX_WORKERS", 8))
+        self.session = build_http_session(pool_size=self.max_workers)
+
+        self.geolocator = Nominatim(user_agent="disaster_monitor_geonews_v3")
+        self.geocode_cache = GeocodeCache(
+            get_geocode_collection(self.db),
+            ttl_days=float(st.secrets.get("GEOCODE_CACHE_TTL_DAYS", 90)),
+            negative_ttl_days=float(st.secrets.get("GEOCODE_NEGATIVE_TTL_DAYS", 1)),
+        )
+        self.dedup_index = NearDuplicateIndex(
+            self.db[st.secrets.get("DEDUP_COLLECTION", "title_signatures")],
+            threshold=float(st.secrets.get("DEDUP_THRESHOLD", 0.7)),
+            window_days=float(st.secrets.get("DEDUP_WINDOW_DAYS", 7)),
+        )
+        self.limiter = get_limiter(
+            'nominatim',
+            rate=float(st.secrets.get("NOMINATIM_RATE_PER_SEC", 1.0)),
+            capacity=int(st.secrets.get("NOMINATIM_BURST", 1)),
+        )
+
+    def close(self):
+        self.session.close()
+        if self.owns_client:
+            close_client()
+
+    def run(self):
+        """
+        Runs one collection cycle as a streaming pipeline:
+
+            fetch -> normalize -> batch -> extract -> geocode -> store
+
+        The extract stage also drops stored URLs and copies of stored stories;
+        the store stage links copies that arrive within the run.
+
+        Stages are connected by bounded queues, so memory stays flat however
+        many pages are pulled, and each batch is stored (and visible to alerts)
+        as soon as it has been geocoded. Returns the storage counts.
+        """
+        watermarks = load_watermarks(
+            self.state_collection, DISASTER_KEYWORDS,
+            overlap_minutes=int(st.secrets.get("INGEST_OVERLAP_MINUTES", 60)),
+        )
+        ensure_indexes(self.collection)
+        batch_size = int(st.secrets.get("PIPELINE_BATCH_SIZE", 64))
+        mongo_batch_size = int(st.secrets.get("MONGO_BATCH_SIZE", 500))
+        lock = threading.Lock()
+        seen_titles = set()
+        latest = {}  # keyword -> newest publish time fetched, for the watermarks
+        retry_from = {}  # keyword -> oldest publish time of an article lost to a geocoding error
+        duplicate_links = []  # (url, canonical url), linked once all canonicals are stored
+        signatures = {}  # url -> (MinHash signature, band keys), from extract to store
+        stats = {'fetched': 0, 'skipped': 0, 'no_location': 0, 'not_geocoded': 0}
+        counts = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+        stored_days = set()  # UTC days with stored articles, whose headline terms are recomputed
+
+        def fetch(keyword):
+            for page in iter_keyword_pages(self.session, self.newsapi_key, keyword, self.max_pages,
+                                           from_time=watermarks.get(keyword)):
+                print(f"   > '{keyword}': {len(page)} article(s)")
+                yield from page
+
+        def normalize(article):
+            stats['fetched'] += 1
+            published = pd.to_datetime(article['timestamp'], errors='coerce', utc=True)
+            keyword = article.pop('keyword')
+            if not pd.isna(published) and (keyword not in latest or published > latest[keyword]):
+                latest[keyword] = published
+            if not (article['title'] and article['timestamp'] and article['url']):
+                return []
+            if article['title'] in seen_titles:
+                return []
+            seen_titles.add(article['title'])
+            return [article]
+
+        def extract(batch):
+            # Skip articles that are already stored before spending NER and geocoding on them
+            existing_urls = find_existing_urls(self.collection, [a['url'] for a in batch])
+            stats['skipped'] += len(existing_urls)
+            batch = [a for a in batch if a['url'] not in existing_urls]
+            # Republished copies of stored stories are linked to them, not stored again.
+            # Signatures are computed once here and looked up with one query per batch.
+            entries = self.dedup_index.entries(batch)
+            matches = self.dedup_index.check_many(entries)
+            with lock:
+                duplicate_links.extend((url, canonical_url) for url, canonical_url in matches.items())
+                signatures.update((url, entry) for url, entry in entries.items() if url not in matches)
+            batch = [a for a in batch if a['url'] not in matches]
+            if not batch:
+                return []
+            for article, locations in zip(batch, self.extractor.extract([a['title'] for a in batch])):
+                article['locations'] = locations
+                article['Location'] = locations[0] if locations else None
+            located = [a for a in batch if a['Location']]
+            stats['no_location'] += len(batch) - len(located)
+            return [located] if located else []
+
+        def geocode(batch):
+            coord_map, failed = self.resolve_locations(list(dict.fromkeys(a['Location'] for a in batch)))
+            records = []
+            for article in batch:
+                if article['Location'] in failed:
+                    # disaster_event is the capitalized keyword; hold that keyword's watermark back
+                    keyword = article['disaster_event'].lower()
+                    published = pd.to_datetime(article['timestamp'], errors='coerce', utc=True)
+                    if not pd.isna(published) and (keyword not in retry_from or published < retry_from[keyword]):
+                        retry_from[keyword] = published
+                latitude, longitude = coord_map.get(article['Location'], (np.nan, np.nan))
+                if pd.isna(latitude) or pd.isna(longitude):
+                    continue
+                article['Latitude'], article['Longitude'] = latitude, longitude
+                records.append(article)
+            stats['not_geocoded'] += len(batch) - len(records)
+            return [records] if records else []
+
+        def store(records):
+            # Copies of a story in this run are checked against the batches stored before them
+            with lock:
+                entries = {record['url']: signatures.pop(record['url']) for record in records}
+            records, links = self.dedup_index.partition(records, entries)
+            # Upsert by URL in unordered bulk batches to avoid duplicates and update existing articles
+            result = bulk_upsert(self.collection, records, batch_size=mongo_batch_size)
+            # Only stored articles become canonicals, so later copies never link to a dropped one
+            stored = find_existing_urls(self.collection, [record['url'] for record in records])
+            self.dedup_index.register([record for record in records if record['url'] in stored], entries)
+            with lock:
+                duplicate_links.extend(links)
+                for key in counts:
+                    counts[key] += result[key]
+                stored_days.update(str(record['timestamp'])[:10] for record in records if record['url'] in stored)
+            print(f"   > Stored {len(stored)} record(s)")
+
+        print("\n--- Streaming articles from NewsAPI into MongoDB ---")
+        errors = run_pipeline(DISASTER_KEYWORDS, [
+            Stage('fetch', fetch, workers=self.max_workers),
+            Stage('normalize', normalize),
+            Batch('batch', size=batch_size, max_wait=float(st.secrets.get("PIPELINE_MAX_WAIT_SECONDS", 2.0))),
+            Stage('extract', extract, queue_size=4),
+            Stage('geocode', geocode, queue_size=4),
+            Stage('store', store, queue_size=4),  # One writer, so each batch sees the signatures of the last
+        ])
+
+        link_duplicates(self.collection, duplicate_links)
+
+        print(f"\nFetched {stats['fetched']} article(s); skipped {stats['skipped']} already stored, "
+              f"{len(duplicate_links)} near-duplicate(s) linked to an earlier article, "
+              f"{stats['no_location']} without a location and {stats['not_geocoded']} that could not be geocoded.")
+        print(f"Inserted {counts['inserted']}, updated {counts['updated']}, unchanged {counts['unchanged']}.")
+        if errors:
+            print(f"!!! {len(errors)} pipeline error(s); keeping the previous watermarks so the articles are retried.")
+        else:
+            # Only move the watermarks past articles that were stored or dropped for good;
+            # a keyword that lost articles to geocoding errors stops just before the oldest one
+            for keyword, published in retry_from.items():
+                if keyword in latest:
+                    latest[keyword] = min(latest[keyword], published - pd.Timedelta(seconds=1))
+            if retry_from:
+                print(f"Holding back the watermarks of {len(retry_from)} keyword(s) to retry articles that could not be geocoded.")
+            save_watermarks(self.state_collection, latest)
+        self.write_term_index(stored_days)
+        self.write_snapshot()
+        return counts
+
+    def write_term_index(self, stored_days):
+        """
+        Recomputes the Insight word cloud's per-day term index from the earliest
+        day this run stored articles for, or for every day until the index has
+        been built in full once.
+        """
         try:
-            time.sleep(1) # Add delay to respect geocoding service limits
-            location_info = geolocator.geocode(loc, timeout=10)
-            if location_info:
-                coord_map[loc] = (location_info.latitude, location_info.longitude)
+            if term_index_built(self.state_collection):
+                if not stored_days:
+                    return
+                since = datetime.datetime.strptime(min(stored_days), '%Y-%m-%d').replace(tzinfo=datetime.timezone.utc)
             else:
-                coord_map[loc] = (np.nan, np.nan)
+                since = None
+            days = update_term_index(
+                self.collection, get_term_collection(self.db), since=since,
+                max_terms=int(st.secrets.get("TERM_INDEX_MAX_TERMS", 500)),
+                state_collection=self.state_collection,
+            )
+            print(f"Term index updated {'for every day' if since is None else f'since {since.date()}'}: {days} day(s).")
+        except Exception as e:
+            print(f"   [Term Index Error] {e}")
+
+    def write_snapshot(self):
+        """Publishes the cleaned dataset as a columnar snapshot for the dashboard (see snapshot.py)."""
+        directory = get_snapshot_dir()
+        if not directory:
+            return
+        try:
+            manifest = update_snapshot(
+                self.collection, directory,
+                max_parts=int(st.secrets.get("SNAPSHOT_MAX_PARTS", 24)),
+            )
+            print(f"Snapshot v{manifest['version']} written to {directory} ({len(manifest['parts'])} part(s)).")
         except Exception as e:
-            print(f"   [Geocoding Error] for '{loc}': {e}")
-            coord_map[loc] = (np.nan, np.nan)
-            
-    df['Latitude'] = df['Location'].map(lambda loc: coord_map.get(loc, (np.nan, np.nan))[0])
-    df['Longitude'] = df['Location'].map(lambda loc: coord_map.get(loc, (np.nan, np.nan))[1])
-    df.dropna(subset=['Latitude', 'Longitude'], inplace=True)
-    
-    final_records = df[['title', 'disaster_event', 'timestamp', 'source', 'url', 'Location', 'Latitude', 'Longitude']].to_dict('records')
-    
-    if not final_records:
-        print("\n!!! SCRIPT STOPPED: No valid records left after processing and geocoding.")
+            print(f"   [Snapshot Error] {e}")
+
+    def resolve_locations(self, locations):
+        """
+        Returns (coord_map, failed): a dict of location -> (lat, lon), with NaNs
+        for unresolved places, and the set of locations whose lookup failed with
+        an error and should be retried. Known places are resolved offline first,
+        then from the cache. Only what is left reaches Nominatim (and its
+        one-request-per-second limit).
+        """
+        coord_map = {}
+        if self.gazetteer:
+            coord_map.update(self.gazetteer.lookup_many(locations))
+            print(f"   > Gazetteer resolved {len(coord_map)} of {len(locations)} location(s)")
+        remaining = [loc for loc in locations if loc not in coord_map]
+        for loc, coords in self.geocode_cache.get_many(remaining).items():
+            coord_map[loc] = coords if coords else (np.nan, np.nan)
+        misses = [loc for loc in remaining if loc not in coord_map]
+        failed = set()
+        if misses:
+            print(f"   > Geocoding {len(misses)} uncached location(s)...")
+            geocoded, failed = geocode_locations(
+                misses, self.geolocator, self.limiter,
+                max_workers=int(st.secrets.get("GEOCODE_WORKERS", 2)),
+            )
+            for loc, coords in geocoded.items():
+                self.geocode_cache.put(loc, coords)
+                coord_map[loc] = coords if coords else (np.nan, np.nan)
+            # Locations that errored are not cached and get retried on the next run
+        print(f"Geocode cache: {self.geocode_cache.stats()}")
+        return coord_map, failed
+
+
+def main():
+    """Main function to run the data collection and storage process."""
+    print("--- Starting Data Collection Script ---")
+
+    try:
+        collector = Collector()
+    except KeyError as e:
+        print(f"!!! FATAL ERROR: Secret key not found: {e}. Check your .streamlit/secrets.toml file.")
+        return
+    except OSError:
+        print("!!! FATAL ERROR: spaCy 'en_core_web_sm' model not found. Please run this command:")
+        print("python -m spacy download en_core_web_sm")
+        return
+    except Exception as e:
+        print(f"!!! FATAL ERROR during start-up: {e}")
         return
 
-    print(f"\n--- Inserting {len(final_records)} valid records into MongoDB ---")
     try:
-        client = MongoClient(MONGO_URI)
-        db = client[DB_NAME]
-        collection = db[COLLECTION_NAME]
-        
-        # Use update_one with upsert=True to avoid duplicates and update existing articles
-        for record in final_records:
-            collection.update_one(
-                {'url': record['url']},  # Find document by its unique URL
-                {'$set': record},       # Set its data to the new record
-                upsert=True             # If it doesn't exist, create it
-            )
-        print("\n--- SCRIPT FINISHED SUCCESSFULLY! ---")
-        print("Database is now populated. You can run 'streamlit run main.py'.")
-        
+        if collector.run() is not None:
+            print("\n--- SCRIPT FINISHED SUCCESSFULLY! ---")
+            print("Database is now populated. You can run 'streamlit run main.py'.")
     except Exception as e:
-        print(f"\n!!! FATAL ERROR during MongoDB insertion: {e}")
+        print(f"\n!!! FATAL ERROR during data collection: {e}")
+    finally:
+        collector.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
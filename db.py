@@ -0,0 +1,82 @@
+# db.py
+
+import threading
+
+import streamlit as st # We use this ONLY to access secrets
+from pymongo import MongoClient
+
+_client = None
+_client_lock = threading.Lock()
+
+def client_options():
+    """
+    Returns the MongoClient keyword arguments from secrets. Every setting is
+    optional; the defaults suit both the dashboard and the batch scripts.
+    """
+    options = {
+        'maxPoolSize': int(st.secrets.get("MONGO_MAX_POOL_SIZE", 50)),
+        'minPoolSize': int(st.secrets.get("MONGO_MIN_POOL_SIZE", 0)),
+        'maxIdleTimeMS': int(st.secrets.get("MONGO_MAX_IDLE_TIME_MS", 300000)),
+        'connectTimeoutMS': int(st.secrets.get("MONGO_CONNECT_TIMEOUT_MS", 10000)),
+        'serverSelectionTimeoutMS': int(st.secrets.get("MONGO_SERVER_SELECTION_TIMEOUT_MS", 10000)),
+        'readPreference': st.secrets.get("MONGO_READ_PREFERENCE", "primary"),
+        'appname': st.secrets.get("MONGO_APP_NAME", "disaster-monitor"),
+    }
+    socket_timeout = st.secrets.get("MONGO_SOCKET_TIMEOUT_MS")
+    if socket_timeout is not None:
+        options['socketTimeoutMS'] = int(socket_timeout)
+    return options
+
+def get_client():
+    """
+    Returns the process-wide MongoClient, creating it on first use. The
+    client is thread-safe and pools its connections, so one instance serves
+    every page, thread and pipeline stage in the process.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = MongoClient(st.secrets["MONGO_URI"], **client_options())
+    return _client
+
+def close_client():
+    """Closes the shared client (at process exit); the next get_client() reconnects."""
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+def get_database():
+    """Returns the application database (DB_NAME) on the shared client."""
+    return get_client()[st.secrets["DB_NAME"]]
+
+# --- Collection Accessors ---
+# Each one takes an optional database handle, e.g. one a caller already holds.
+
+def _collection(key, default, db=None):
+    if db is None:
+        db = get_database()
+    name = st.secrets[key] if default is None else st.secrets.get(key, default)
+    return db[name]
+
+def get_disaster_collection(db=None):
+    """The collection of geocoded disaster articles (COLLECTION_NAME)."""
+    return _collection("COLLECTION_NAME", None, db)
+
+def get_subscription_collection(db=None):
+    """The collection of user alert subscriptions (SUBSCRIPTIONS_COLLECTION)."""
+    return _collection("SUBSCRIPTIONS_COLLECTION", None, db)
+
+def get_geocode_collection(db=None):
+    """The collection backing the geocoding cache (GEOCODE_COLLECTION)."""
+    return _collection("GEOCODE_COLLECTION", "geocode_cache", db)
+
+def get_state_collection(db=None):
+    """The collection of ingest watermarks and the alert checkpoint (INGEST_STATE_COLLECTION)."""
+    return _collection("INGEST_STATE_COLLECTION", "ingest_state", db)
+
+def get_term_collection(db=None):
+    """The per-day headline term counts behind the Insight word cloud (TERM_COLLECTION)."""
+    return _collection("TERM_COLLECTION", "daily_terms", db)
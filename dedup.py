@@ -0,0 +1,169 @@
+# dedup.py
+
+import hashlib
+import re
+import zlib
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from pymongo import ASCENDING, UpdateOne
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+
+def normalize_title(title):
+    """
+    Lowercases a headline and strips punctuation and the trailing
+    " - Source Name" that NewsAPI appends, so republished copies compare equal.
+    """
+    title = re.sub(r"\s+[-|–—]\s+[^-|–—]+$", '', str(title or ''))
+    return ' '.join(re.sub(r"[^\w\s]", ' ', title.casefold()).split())
+
+def shingles(text, k=5):
+    """Returns the set of overlapping `k`-character shingles of `text`."""
+    if len(text) <= k:
+        return {text} if text else set()
+    return {text[i:i + k] for i in range(len(text) - k + 1)}
+
+
+class NearDuplicateIndex:
+    """
+    MinHash/LSH index over normalized headline shingles, persisted in a MongoDB
+    collection so each new article is compared against recent history.
+
+    Each stored document holds an article's MinHash signature and its LSH band
+    keys. A multikey index on the band keys lets a lookup fetch only the
+    articles that share at least one band, instead of scanning every title.
+    Candidates whose estimated Jaccard similarity reaches `threshold` are
+    treated as duplicates. Only stored articles are registered (see
+    register()), so every match points at a record that exists. Entries
+    expire after `window_days`, counted from when each one was recorded, so
+    changing the window never touches the index.
+    """
+
+    def __init__(self, collection, num_perm=64, bands=16, threshold=0.7, window_days=7, seed=1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.collection = collection
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.window = timedelta(days=window_days)
+        # Fixed seed: signatures must stay comparable across runs
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, (1 << 32) - 1, size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, (1 << 32) - 1, size=num_perm, dtype=np.uint64)
+        self.collection.create_index([('bands', ASCENDING)], name='bands')
+        # MongoDB deletes documents once their 'expires_at' has passed
+        self.collection.create_index('expires_at', expireAfterSeconds=0)
+
+    def signature(self, title):
+        """Returns the MinHash signature of a headline as a uint64 array."""
+        hashed = np.array(
+            [zlib.crc32(s.encode('utf-8')) for s in shingles(normalize_title(title))] or [0],
+            dtype=np.uint64,
+        )
+        # (a * x + b) mod p for every permutation and shingle; a, b, x < 2^32 so nothing overflows
+        permuted = (np.outer(self._a, hashed) + self._b[:, None]) % _MERSENNE_PRIME
+        return permuted.min(axis=1)
+
+    def band_keys(self, signature):
+        return [
+            f"{i}:{hashlib.blake2b(signature[i * self.rows:(i + 1) * self.rows].tobytes(), digest_size=8).hexdigest()}"
+            for i in range(self.bands)
+        ]
+
+    def entries(self, articles):
+        """
+        Returns {url: (signature, band keys)} for article dicts with 'url' and
+        'title'. Compute them once per batch and pass them to the lookups.
+        """
+        entries = {}
+        for article in articles:
+            signature = self.signature(article['title'])
+            entries[article['url']] = (signature, self.band_keys(signature))
+        return entries
+
+    def candidates(self, entries):
+        """
+        Fetches the registered articles sharing a band with any of `entries` in
+        one query. Returns {band key: [(url, signature)]}.
+        """
+        bands = list({band for _, keys in entries.values() for band in keys})
+        by_band = defaultdict(list)
+        if not bands:
+            return by_band
+        query = {'bands': {'$in': bands}, 'expires_at': {'$gt': datetime.now(timezone.utc)}}
+        for doc in self.collection.find(query, {'signature': 1, 'bands': 1}):
+            candidate = (doc['_id'], np.asarray(doc['signature'], dtype=np.uint64))
+            for band in doc['bands']:
+                by_band[band].append(candidate)
+        return by_band
+
+    def find_canonical(self, signature, bands, candidates):
+        """Returns the URL of the best match among the `candidates` ({band: [(url, signature)]}) sharing a band, or None."""
+        best_url, best_score = None, self.threshold
+        for band in bands:
+            for url, candidate in candidates.get(band, ()):
+                score = float(np.mean(candidate == signature))
+                if score >= best_score:
+                    best_url, best_score = url, score
+        return best_url
+
+    def check_many(self, entries):
+        """
+        Returns {url: canonical url} for the `entries` that are near-duplicates
+        of a registered article other than themselves, with one query. Records
+        nothing.
+        """
+        candidates = self.candidates(entries)
+        matches = {}
+        for url, (signature, bands) in entries.items():
+            canonical_url = self.find_canonical(signature, bands, candidates)
+            if canonical_url and canonical_url != url:
+                matches[url] = canonical_url
+        return matches
+
+    def partition(self, articles, entries):
+        """
+        Splits article dicts into (unique articles, [(url, canonical url)]
+        links), with one query. Each article is also compared with the unique
+        ones before it, so copies within `articles` are caught too.
+        """
+        candidates = self.candidates(entries)
+        unique, links = [], []
+        for article in articles:
+            signature, bands = entries[article['url']]
+            canonical_url = self.find_canonical(signature, bands, candidates)
+            if canonical_url and canonical_url != article['url']:
+                links.append((article['url'], canonical_url))
+            else:
+                unique.append(article)
+                for band in bands:
+                    candidates[band].append((article['url'], signature))
+        return unique, links
+
+    def register(self, articles, entries):
+        """
+        Records article dicts as canonicals for later lookups. Only register
+        articles once they are stored, so that a later copy is never linked
+        to an article that was dropped on the way.
+        """
+        if not articles:
+            return
+        now = datetime.now(timezone.utc)
+        operations = []
+        for article in articles:
+            signature, bands = entries[article['url']]
+            operations.append(UpdateOne(
+                {'_id': article['url']},
+                {'$setOnInsert': {
+                    'signature': [int(v) for v in signature],
+                    'bands': bands,
+                    'created_at': now,
+                    'expires_at': now + self.window,
+                }},
+                upsert=True
+            ))
+        self.collection.bulk_write(operations, ordered=False)
@@ -0,0 +1,172 @@
+# extraction.py
+
+import os
+import re
+
+import streamlit as st
+from pymongo import UpdateOne
+
+from db import get_disaster_collection
+from geocoding import normalize_location
+
+DEFAULT_MODEL = "en_core_web_sm"
+
+# Words that turn the following name into a storm name ("Hurricane Florence")
+STORM_PREFIXES = {'hurricane', 'storm', 'typhoon', 'cyclone', 'tropical', 'tornado'}
+
+WORD_PATTERN = re.compile(r"[^\W_]+(?:['’.\-][^\W_]+)*\.?")
+
+def load_ner_model(model_name=DEFAULT_MODEL):
+    """
+    Loads a spaCy pipeline with every component disabled except 'ner' and
+    any shared tok2vec layer that 'ner' listens to. Raises OSError if the
+    model is not installed.
+    """
+    import spacy  # Imported lazily so the matcher mode never pays for it
+    nlp = spacy.load(model_name)
+    needed = {'ner'}
+    for name, component in nlp.pipeline:
+        if 'ner' in getattr(component, 'listening_components', []):
+            needed.add(name)
+    nlp.select_pipes(disable=[name for name in nlp.pipe_names if name not in needed])
+    return nlp
+
+def extract_gpes(nlp, titles, batch_size=64, n_process=1):
+    """
+    Runs NER over `titles` in batches and returns, for each title, the list of
+    distinct GPE entities in the order they appear. Multiple processes are only
+    started when there is enough work to pay for their start-up.
+    """
+    titles = [str(title) for title in titles]
+    if n_process > 1 and len(titles) < batch_size * n_process * 2:
+        n_process = 1
+
+    locations = []
+    for doc in nlp.pipe(titles, batch_size=batch_size, n_process=n_process):
+        gpes = [ent.text for ent in doc.ents if ent.label_ == 'GPE']
+        locations.append(list(dict.fromkeys(gpes)))
+    return locations
+
+class PlaceMatcher:
+    """
+    Dictionary-based location extractor over the gazetteer's matcher keys.
+    Each title is scanned once, trying the longest word n-gram first at every
+    position, so extraction costs a few hash lookups per word and needs no
+    model.
+    """
+
+    def __init__(self, keys, max_words=5):
+        self.keys = set(keys)
+        self.max_words = min(max_words, max((len(key.split()) for key in self.keys), default=1))
+
+    @classmethod
+    def from_gazetteer(cls, gazetteer):
+        return cls(gazetteer.matcher_keys())
+
+    def match(self, title):
+        """Returns the distinct place names found in `title`, as written in the title."""
+        title = str(title)
+        words = list(WORD_PATTERN.finditer(title))
+        normalized = [normalize_location(word.group()) for word in words]
+        found = []
+        i = 0
+        while i < len(words):
+            for n in range(min(self.max_words, len(words) - i), 0, -1):
+                key = ' '.join(normalized[i:i + n])
+                if key not in self.keys:
+                    continue
+                surface = title[words[i].start():words[i + n - 1].end()]
+                if surface.endswith('.') and '.' not in surface[:-1]:
+                    surface = surface[:-1]  # Sentence full stop, not an abbreviation
+                # Short keys ("US", "UK") only count when written in capitals
+                if not surface[:1].isupper() or (len(key) <= 3 and not surface.isupper()):
+                    continue
+                if i == 0 or normalized[i - 1] not in STORM_PREFIXES:
+                    found.append(surface)
+                i += n
+                break
+            else:
+                i += 1
+        return list(dict.fromkeys(found))
+
+
+class LocationExtractor:
+    """
+    Extracts location names from titles in one of two modes:
+
+    - 'ner': spaCy NER over every title (see extract_gpes).
+    - 'matcher': the gazetteer PlaceMatcher, falling back to NER only for
+      titles with no match. The spaCy model is loaded on first fallback.
+    """
+
+    def __init__(self, mode='ner', gazetteer=None, ner_fallback=True, batch_size=64, n_process=1):
+        if mode == 'matcher' and gazetteer is None:
+            print("   > Gazetteer index not found; falling back to the 'ner' extractor.")
+            mode = 'ner'
+        if mode not in ('ner', 'matcher'):
+            raise ValueError(f"Unknown location extractor mode: {mode!r}")
+        self.mode = mode
+        self.ner_fallback = ner_fallback
+        self.batch_size = batch_size
+        self.n_process = n_process
+        self.matcher = PlaceMatcher.from_gazetteer(gazetteer) if mode == 'matcher' else None
+        self._nlp = None
+        if mode == 'ner':
+            self._nlp = load_ner_model()  # Fail early when the model is missing
+
+    @property
+    def nlp(self):
+        if self._nlp is None:
+            self._nlp = load_ner_model()
+        return self._nlp
+
+    def extract(self, titles):
+        """Returns a list of location names for each title."""
+        titles = list(titles)
+        if self.mode == 'ner':
+            return extract_gpes(self.nlp, titles, batch_size=self.batch_size, n_process=self.n_process)
+
+        locations = [self.matcher.match(title) for title in titles]
+        unmatched = [i for i, found in enumerate(locations) if not found]
+        if unmatched and self.ner_fallback:
+            try:
+                nlp = self.nlp
+            except OSError:
+                print(f"   > spaCy model '{DEFAULT_MODEL}' not found; skipping the NER fallback.")
+                self.ner_fallback = False
+                return locations
+            fallback = extract_gpes(nlp, [titles[i] for i in unmatched],
+                                    batch_size=self.batch_size, n_process=self.n_process)
+            for i, found in zip(unmatched, fallback):
+                locations[i] = found
+        return locations
+
+
+def backfill_locations(chunk_size=5000):
+    """
+    Re-runs NER over stored articles that have no 'locations' field yet,
+    using every available core. Meant for one-off backfills of old history.
+    """
+    collection = get_disaster_collection()
+    nlp = load_ner_model()
+    n_process = int(st.secrets.get("NER_PROCESSES", os.cpu_count() or 1))
+    batch_size = int(st.secrets.get("NER_BATCH_SIZE", 64))
+
+    updated = 0
+    while True:
+        docs = list(collection.find({'locations': {'$exists': False}}, {'title': 1}).limit(chunk_size))
+        if not docs:
+            break
+        titles = [doc.get('title') or '' for doc in docs]
+        results = extract_gpes(nlp, titles, batch_size=batch_size, n_process=n_process)
+        collection.bulk_write([
+            UpdateOne({'_id': doc['_id']}, {'$set': {'locations': gpes}})
+            for doc, gpes in zip(docs, results)
+        ], ordered=False)
+        updated += len(docs)
+        print(f"   > Backfilled locations for {updated} article(s)...")
+    print(f"Backfill finished. Updated {updated} article(s).")
+
+
+if __name__ == "__main__":
+    backfill_locations()
@@ -0,0 +1,241 @@
+# gazetteer.py
+
+import argparse
+import io
+import os
+import sqlite3
+import threading
+import zipfile
+from collections import namedtuple
+
+import requests
+
+from geocoding import normalize_location
+
+GEONAMES_URL = 'https://download.geonames.org/export/dump/'
+DEFAULT_DATASET = 'cities15000'  # All cities with a population above 15,000
+DEFAULT_INDEX_PATH = os.path.join('data', 'gazetteer.sqlite')
+DEFAULT_SOURCE_DIR = os.path.join('data', 'geonames')
+
+# Common ways headlines refer to countries that GeoNames does not list as names
+COUNTRY_ALIASES = {
+    'US': ['usa', 'us', 'united states of america', 'america'],
+    'GB': ['uk', 'britain', 'great britain', 'england'],
+    'AE': ['uae'],
+    'KR': ['korea'],
+    'CD': ['drc', 'dr congo'],
+    'CZ': ['czech republic'],
+    'MM': ['burma'],
+    'CI': ['ivory coast'],
+    'TR': ['turkiye', 'türkiye'],
+    'PS': ['gaza', 'west bank'],
+}
+
+# Place names that are far more often ordinary headline words than places.
+# They are left out of the phrase matcher but stay available for lookups.
+MATCHER_STOPWORDS = {
+    'mobile', 'nice', 'split', 'male', 'reading', 'surprise', 'orange', 'independence',
+    'hope', 'deal', 'university', 'police', 'victory', 'union', 'commerce', 'sandy',
+    'florence', 'ida', 'harvey', 'laura', 'katrina', 'helene', 'milton', 'beryl',
+}
+
+Place = namedtuple('Place', ['name', 'latitude', 'longitude', 'feature', 'country_code', 'population'])
+
+# --- Building the index ---
+
+def download_source(name, source_dir=DEFAULT_SOURCE_DIR):
+    """Downloads one GeoNames dump file (unzipping it if needed) and returns its local path."""
+    os.makedirs(source_dir, exist_ok=True)
+    path = os.path.join(source_dir, f"{name}.txt")
+    if os.path.exists(path):
+        return path
+
+    remote = f"{name}.zip" if name.startswith('cities') else f"{name}.txt"
+    print(f"   > Downloading {GEONAMES_URL}{remote}...")
+    response = requests.get(GEONAMES_URL + remote, timeout=120)
+    response.raise_for_status()
+    if remote.endswith('.zip'):
+        with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+            archive.extract(f"{name}.txt", source_dir)
+    else:
+        with open(path, 'wb') as f:
+            f.write(response.content)
+    return path
+
+def _read_rows(path):
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.startswith('#') or not line.strip():
+                continue
+            yield line.rstrip('\n').split('\t')
+
+def _weighted_centroid(members):
+    total = sum(max(population, 1) for _, _, population in members)
+    latitude = sum(lat * max(population, 1) for lat, _, population in members) / total
+    longitude = sum(lon * max(population, 1) for _, lon, population in members) / total
+    return latitude, longitude
+
+def build_index(cities_path, country_path, admin1_path, output_path=DEFAULT_INDEX_PATH,
+                matcher_min_population=100000):
+    """
+    Builds the on-disk SQLite index from GeoNames files.
+
+    Cities come straight from the cities file. Countries are placed at their
+    capital and first-level regions (e.g. 'California') at the
+    population-weighted centroid of their cities, since the city dumps carry
+    no coordinates for them. Every place is reachable through its name, its
+    ASCII name and its Latin-script alternate names, all normalized the same
+    way as the geocode cache keys.
+
+    The index also stores the key set used by the phrase-matcher extractor:
+    aliases of countries, regions and cities with at least
+    `matcher_min_population` inhabitants, minus MATCHER_STOPWORDS.
+    """
+    places = []
+    aliases = set()
+    cities_by_country = {}
+    cities_by_admin1 = {}
+
+    for row in _read_rows(cities_path):
+        place_id = int(row[0])
+        latitude, longitude, population = float(row[4]), float(row[5]), int(row[14] or 0)
+        country_code, admin1_code = row[8], row[10]
+        places.append((place_id, row[1], latitude, longitude, 'city', country_code, population))
+        cities_by_country.setdefault(country_code, []).append((row[1], latitude, longitude, population))
+        cities_by_admin1.setdefault(f"{country_code}.{admin1_code}", []).append((latitude, longitude, population))
+        names = [row[1], row[2]] + [n for n in row[3].split(',') if n.isascii() and len(n) > 2]
+        aliases.update((normalize_location(n), place_id) for n in names if n)
+
+    for row in _read_rows(admin1_path):
+        members = cities_by_admin1.get(row[0])
+        if not members:
+            continue
+        latitude, longitude = _weighted_centroid(members)
+        population = sum(population for _, _, population in members)
+        place_id = int(row[3])
+        places.append((place_id, row[1], latitude, longitude, 'admin1', row[0].split('.')[0], population))
+        aliases.update((normalize_location(n), place_id) for n in (row[1], row[2]))
+
+    for row in _read_rows(country_path):
+        country_code, name, capital = row[0], row[4], row[5]
+        members = cities_by_country.get(country_code)
+        if not members or not row[16]:
+            continue
+        capitals = [m for m in members if m[0] == capital]
+        if capitals:
+            _, latitude, longitude, _ = max(capitals, key=lambda m: m[3])
+        else:
+            latitude, longitude = _weighted_centroid([m[1:] for m in members])
+        place_id = int(row[16])
+        places.append((place_id, name, latitude, longitude, 'country', country_code, int(row[7] or 0)))
+        for alias in [name] + COUNTRY_ALIASES.get(country_code, []):
+            aliases.add((normalize_location(alias), place_id))
+
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    tmp_path = output_path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    conn.executescript("""
+        CREATE TABLE places (
+            id INTEGER PRIMARY KEY, name TEXT, latitude REAL, longitude REAL,
+            feature TEXT, country_code TEXT, population INTEGER
+        );
+        CREATE TABLE aliases (
+            key TEXT, place_id INTEGER, PRIMARY KEY (key, place_id)
+        ) WITHOUT ROWID;
+        CREATE TABLE matcher_keys (key TEXT PRIMARY KEY) WITHOUT ROWID;
+    """)
+    conn.executemany("INSERT OR REPLACE INTO places VALUES (?, ?, ?, ?, ?, ?, ?)", places)
+    conn.executemany("INSERT OR IGNORE INTO aliases VALUES (?, ?)", sorted(a for a in aliases if a[0]))
+    conn.execute("""
+        INSERT OR IGNORE INTO matcher_keys
+        SELECT DISTINCT a.key FROM aliases a JOIN places p ON p.id = a.place_id
+        WHERE p.feature != 'city' OR p.population >= ?
+    """, (matcher_min_population,))
+    conn.executemany("DELETE FROM matcher_keys WHERE key = ?", [(w,) for w in MATCHER_STOPWORDS])
+    conn.execute("CREATE INDEX places_name ON places (name)")
+    conn.commit()
+    conn.execute("VACUUM")
+    conn.close()
+    os.replace(tmp_path, output_path)  # Readers never see a half-written index
+    print(f"Gazetteer index written to {output_path}: {len(places)} places, {len(aliases)} aliases.")
+    return output_path
+
+# --- Querying the index ---
+
+class Gazetteer:
+    """
+    Read-only lookups against the index built by build_index().
+    Results are memoized, so repeated names cost a dict lookup.
+    """
+
+    def __init__(self, path=DEFAULT_INDEX_PATH):
+        self.path = path
+        self._conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._memo = {}
+
+    @classmethod
+    def open(cls, path=DEFAULT_INDEX_PATH):
+        """Returns a Gazetteer for `path`, or None if the index has not been built."""
+        if not path or not os.path.exists(path):
+            return None
+        return cls(path)
+
+    def candidates(self, name, limit=5):
+        """Returns places matching `name`, exact names first, then by descending population."""
+        key = normalize_location(name)
+        if not key:
+            return []
+        with self._lock:
+            rows = self._conn.execute("""
+                SELECT name, latitude, longitude, feature, country_code, population
+                FROM places WHERE name = ?
+                UNION
+                SELECT p.name, p.latitude, p.longitude, p.feature, p.country_code, p.population
+                FROM aliases a JOIN places p ON p.id = a.place_id WHERE a.key = ?
+                ORDER BY population DESC LIMIT ?
+            """, (name, key, limit * 2)).fetchall()
+        places = [Place(*row) for row in rows]
+        places.sort(key=lambda p: (p.name != name, -p.population))
+        return places[:limit]
+
+    def lookup(self, name):
+        """Returns (lat, lon) for the best match of `name`, or None if it is unknown."""
+        if name not in self._memo:
+            best = self.candidates(name, limit=1)
+            self._memo[name] = (best[0].latitude, best[0].longitude) if best else None
+        return self._memo[name]
+
+    def matcher_keys(self):
+        """Returns the set of normalized place names used by the phrase matcher."""
+        with self._lock:
+            return {key for (key,) in self._conn.execute("SELECT key FROM matcher_keys")}
+
+    def lookup_many(self, names):
+        """Returns a dict of name -> (lat, lon) for every name found in the index."""
+        found = {}
+        for name in names:
+            coords = self.lookup(name)
+            if coords:
+                found[name] = coords
+        return found
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the offline gazetteer index from GeoNames dumps.")
+    parser.add_argument('--dataset', default=DEFAULT_DATASET, help="GeoNames cities dump, e.g. cities15000 or cities5000")
+    parser.add_argument('--source-dir', default=DEFAULT_SOURCE_DIR, help="Where downloaded GeoNames files are kept")
+    parser.add_argument('--output', default=DEFAULT_INDEX_PATH, help="Path of the SQLite index to write")
+    parser.add_argument('--matcher-min-population', type=int, default=100000,
+                        help="Smallest city included in the phrase matcher")
+    args = parser.parse_args()
+
+    build_index(
+        download_source(args.dataset, args.source_dir),
+        download_source('countryInfo', args.source_dir),
+        download_source('admin1CodesASCII', args.source_dir),
+        output_path=args.output,
+        matcher_min_population=args.matcher_min_population,
+    )
@@ -0,0 +1,130 @@
+# geocoding.py
+
+import random
+import re
+import time
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from geopy.exc import GeocoderTimedOut, GeocoderUnavailable
+
+def normalize_location(name):
+    """
+    Builds the cache key for a place name, so that 'Japan', ' JAPAN ' and
+    'Japan.' all share one entry.
+    """
+    if not name:
+        return ''
+    key = unicodedata.normalize('NFKC', str(name)).casefold().replace('.', '')
+    key = re.sub(r"[^\w\s'-]", ' ', key)
+    return ' '.join(key.split())
+
+
+class GeocodeCache:
+    """
+    Persistent geocode cache stored in a MongoDB collection.
+
+    Each document is keyed by the normalized place name and holds its
+    coordinates, or null coordinates for a place the geocoder could not
+    resolve. Misses expire sooner than hits so that they get retried.
+    """
+
+    def __init__(self, collection, ttl_days=90, negative_ttl_days=1):
+        self.collection = collection
+        self.ttl = timedelta(days=ttl_days)
+        self.negative_ttl = timedelta(days=negative_ttl_days)
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        # MongoDB deletes documents once their 'expires_at' has passed
+        self.collection.create_index('expires_at', expireAfterSeconds=0)
+
+    def get_many(self, names):
+        """
+        Looks up all names in a single query. Returns a dict of name -> (lat, lon)
+        for cached places and name -> None for cached misses. Names that are not
+        in the cache are left out of the result.
+        """
+        keys = {}
+        for name in names:
+            keys.setdefault(normalize_location(name), []).append(name)
+
+        now = datetime.now(timezone.utc)
+        found = {}
+        for doc in self.collection.find({'_id': {'$in': list(keys)}, 'expires_at': {'$gt': now}}):
+            for name in keys.pop(doc['_id'], []):
+                if doc.get('latitude') is None:
+                    found[name] = None
+                    self.negative_hits += 1
+                else:
+                    found[name] = (doc['latitude'], doc['longitude'])
+                    self.hits += 1
+
+        self.misses += sum(len(names) for names in keys.values())
+        return found
+
+    def put(self, name, coords):
+        """Stores a geocoding result. Pass `coords=None` to remember a miss."""
+        now = datetime.now(timezone.utc)
+        latitude, longitude = coords if coords else (None, None)
+        self.collection.update_one(
+            {'_id': normalize_location(name)},
+            {'$set': {
+                'query': name,
+                'latitude': latitude,
+                'longitude': longitude,
+                'cached_at': now,
+                'expires_at': now + (self.ttl if coords else self.negative_ttl),
+            }},
+            upsert=True
+        )
+
+    def stats(self):
+        """Returns the hit/miss counters as a printable string."""
+        lookups = self.hits + self.negative_hits + self.misses
+        hit_rate = (self.hits + self.negative_hits) / lookups if lookups else 0.0
+        return (f"{self.hits} hit(s), {self.negative_hits} negative hit(s), "
+                f"{self.misses} miss(es) ({hit_rate:.0%} served from cache)")
+
+
+def geocode_with_retry(geocode, name, retries=3, backoff=2.0, timeout=10):
+    """
+    Geocodes one place name. Timeouts are retried with jittered exponential
+    backoff. Returns (lat, lon), None when the geocoder has no match, or raises
+    the last error if every attempt failed.
+    """
+    for attempt in range(retries + 1):
+        try:
+            location_info = geocode(name, timeout=timeout)
+            return (location_info.latitude, location_info.longitude) if location_info else None
+        except (GeocoderTimedOut, GeocoderUnavailable):
+            if attempt == retries:
+                raise
+            time.sleep(backoff * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+def geocode_locations(names, geolocator, limiter, max_workers=2, retries=3):
+    """
+    Geocodes cache misses on a small worker pool. Every request first takes a
+    token from `limiter`, so the pool as a whole stays within the provider's rate.
+
+    Returns (results, failed): a dict of name -> (lat, lon) or None (no match),
+    and the set of names whose lookup failed with an error. Failed names are
+    left out of the results so that they are not cached.
+    """
+    geocode = limiter.wrap(geolocator.geocode)
+
+    def lookup(name):
+        try:
+            return name, geocode_with_retry(geocode, name, retries=retries), None
+        except Exception as e:
+            return name, None, e
+
+    results, failed = {}, set()
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        for name, coords, error in executor.map(lookup, names):
+            if error is not None:
+                print(f"   [Geocoding Error] for '{name}': {error}")
+                failed.add(name)
+                continue
+            results[name] = coords
+    return results, failed
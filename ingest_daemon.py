@@ -0,0 +1,76 @@
+# ingest_daemon.py
+
+import random
+import signal
+import threading
+import time
+from datetime import datetime, timezone
+
+import streamlit as st # We use this ONLY to access secrets
+
+from datacollection import Collector
+from db import get_subscription_collection
+from notification_engine import check_for_alerts
+from subscriptions import SubscriptionIndex
+
+def run_cycle(collector, index=None):
+    """Runs one collection pass followed by one alert check, reusing the warm collector and subscription index."""
+    try:
+        collector.run()
+    except Exception as e:
+        print(f"\n!!! ERROR during data collection: {e}")
+    try:
+        check_for_alerts(db=collector.db, index=index)
+    except Exception as e:
+        print(f"\n!!! ERROR during alert check: {e}")
+
+def next_delay(interval_seconds, jitter_seconds, elapsed):
+    """Seconds to wait before the next cycle, spread by +/- `jitter_seconds`."""
+    return max(0.0, interval_seconds - elapsed + random.uniform(-jitter_seconds, jitter_seconds))
+
+def main():
+    """
+    Long-running replacement for the cron job: loads the NLP model, HTTP
+    session, MongoDB client and caches once, then collects and checks alerts
+    every DAEMON_INTERVAL_MINUTES until it receives SIGTERM or SIGINT.
+    """
+    interval_seconds = float(st.secrets.get("DAEMON_INTERVAL_MINUTES", 15)) * 60
+    jitter_seconds = float(st.secrets.get("DAEMON_JITTER_SECONDS", 30))
+
+    stop = threading.Event()
+    def request_stop(signum, frame):
+        print(f"\nReceived signal {signum}; stopping after the current cycle...")
+        stop.set()
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    print("--- Starting Ingest Daemon ---")
+    try:
+        collector = Collector()
+        # Loaded in full on the first alert check, then refreshed incrementally
+        index = SubscriptionIndex(get_subscription_collection(collector.db))
+    except KeyError as e:
+        print(f"!!! FATAL ERROR: Secret key not found: {e}. Check your .streamlit/secrets.toml file.")
+        return
+    except OSError:
+        print("!!! FATAL ERROR: spaCy 'en_core_web_sm' model not found. Please run this command:")
+        print("python -m spacy download en_core_web_sm")
+        return
+    except Exception as e:
+        print(f"!!! FATAL ERROR during start-up: {e}")
+        return
+
+    try:
+        while not stop.is_set():
+            started = time.monotonic()
+            print(f"\n=== Cycle started at {datetime.now(timezone.utc).isoformat()} ===")
+            run_cycle(collector, index)
+            delay = next_delay(interval_seconds, jitter_seconds, time.monotonic() - started)
+            print(f"=== Cycle finished; next one in {delay:.0f}s ===")
+            stop.wait(delay)
+    finally:
+        collector.close()
+        print("--- Ingest Daemon stopped ---")
+
+if __name__ == "__main__":
+    main()
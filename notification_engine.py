@@ -4,13 +4,33 @@ import smtplib
 import ssl
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from pymongo import MongoClient
+from bson import ObjectId
+from pymongo import ASCENDING
+from db import get_database, get_disaster_collection, get_state_collection, get_subscription_collection
+from subscriptions import SubscriptionIndex
 from datetime import datetime, timedelta, timezone
 import streamlit as st # We use this ONLY to access secrets
 import json
 
+ALERT_CHECKPOINT_ID = 'alerts'
+
 # --- Helper Functions ---
 
+def load_alert_checkpoint(state_collection, lookback_minutes=30):
+    """
+    Returns the disaster _id up to which alerts have been handled. Before the
+    first check there is none, so it starts with the articles inserted in the
+    last `lookback_minutes` (ObjectIds carry their insertion time).
+    """
+    doc = state_collection.find_one({'_id': ALERT_CHECKPOINT_ID})
+    if doc and doc.get('last_id') is not None:
+        return doc['last_id']
+    return ObjectId.from_datetime(datetime.now(timezone.utc) - timedelta(minutes=lookback_minutes))
+
+def save_alert_checkpoint(state_collection, last_id):
+    """Moves the alert checkpoint forward to `last_id` (never back)."""
+    state_collection.update_one({'_id': ALERT_CHECKPOINT_ID}, {'$max': {'last_id': last_id}}, upsert=True)
+
 def send_alert_email(recipient_email, disaster):
     """Formats and sends a single disaster alert email."""
     try:
@@ -57,37 +77,44 @@ def send_alert_email(recipient_email, disaster):
         print(f"   -> FAILED to send email to {recipient_email}: {e}")
         return False
 
-def check_for_alerts():
-    """The main engine function. Finds new disasters and emails matching subscribers."""
+def check_for_alerts(db=None, index=None):
+    """
+    The main engine function. Finds new disasters and emails matching subscribers.
+    Uses the shared pooled client from db.py unless a database handle is passed in.
+    Pass a SubscriptionIndex to keep it across calls; it is then only refreshed.
+    """
     print(f"\n--- Running Alert Check at {datetime.now(timezone.utc).isoformat()} ---")
 
     try:
-        MONGO_URI = st.secrets["MONGO_URI"]
-        DB_NAME = st.secrets["DB_NAME"]
-        DISASTER_COLLECTION = st.secrets["COLLECTION_NAME"]
-        SUBS_COLLECTION = st.secrets["SUBSCRIPTIONS_COLLECTION"]
-        client = MongoClient(MONGO_URI)
-        db = client[DB_NAME]
-        disaster_collection = db[DISASTER_COLLECTION]
-        subs_collection = db[SUBS_COLLECTION]
+        if db is None:
+            db = get_database()
+        disaster_collection = get_disaster_collection(db)
+        subs_collection = get_subscription_collection(db)
+        state_collection = get_state_collection(db)
     except KeyError as e:
         print(f"Error: MongoDB credentials missing from secrets.toml: {e}")
         return
 
-    # To find "new" disasters, we fetch disasters from the last 30 minutes.
-    # A more robust system would use a flag like `alert_sent: true`.
-    time_window = datetime.now(timezone.utc) - timedelta(minutes=30)
-    new_disasters = list(disaster_collection.find({"timestamp": {"$gte": time_window}}))
+    # "New" disasters are the ones inserted since the last check, so however often
+    # this runs (cron or ingest_daemon.py), each report is alerted on once.
+    checkpoint = load_alert_checkpoint(
+        state_collection, lookback_minutes=int(st.secrets.get("ALERT_LOOKBACK_MINUTES", 30))
+    )
+    new_disasters = list(disaster_collection.find({"_id": {"$gt": checkpoint}}).sort("_id", ASCENDING))
 
     if not new_disasters:
-        print("No new disasters found in the last 30 minutes. Ending check.")
+        print("No new disasters found since the last check. Ending check.")
         return
         
-    print(f"Found {len(new_disasters)} recent disaster reports to process.")
+    print(f"Found {len(new_disasters)} new disaster reports to process.")
 
-    all_subscriptions = list(subs_collection.find())
-    if not all_subscriptions:
+    # (event, location) -> subscriber emails, so each match is a single lookup
+    if index is None:
+        index = SubscriptionIndex(subs_collection)
+    index.refresh()
+    if not len(index):
         print("No user subscriptions found. Ending check.")
+        save_alert_checkpoint(state_collection, new_disasters[-1]["_id"])
         return
         
     # --- The Core Matching Logic ---
@@ -97,19 +124,17 @@ def check_for_alerts():
         location = disaster["Location"]
         print(f"\nProcessing: {event} in {location}")
         
-        # Find all users subscribed to this specific event AND location
-        matching_subscribers = [
-            sub for sub in all_subscriptions
-            if event in sub.get("selected_events", []) and location in sub.get("selected_locations", [])
-        ]
+        # Find all users subscribed to this event AND this location (by name, or by radius around a point)
+        matching_subscribers = index.match(event, location, disaster.get("Latitude"), disaster.get("Longitude"))
         
         if matching_subscribers:
             print(f"  Found {len(matching_subscribers)} matching subscriber(s).")
-            for subscriber in matching_subscribers:
-                if send_alert_email(subscriber["email"], disaster):
+            for email in sorted(matching_subscribers):
+                if send_alert_email(email, disaster):
                     alerts_sent_count += 1
         else:
             print("  No matching subscribers found for this event.")
+        save_alert_checkpoint(state_collection, disaster["_id"])
             
     print(f"\n--- Alert Check Finished. Sent {alerts_sent_count} total alert(s). ---")
 
@@ -5,9 +5,10 @@ import smtplib
 import ssl
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
-from pymongo import MongoClient
 from datetime import datetime, timezone
-from utils import load_data
+from db import get_subscription_collection
+from subscriptions import SubscriptionIndex
+from utils import get_db, load_query_engine
 
 # --- Helper functions ---
 
@@ -16,17 +17,33 @@ def get_current_subscription(email):
     if not email:
         return None
     try:
-        MONGO_URI = st.secrets["MONGO_URI"]
-        DB_NAME = st.secrets["DB_NAME"]
-        SUBSCRIPTIONS_COLLECTION = st.secrets["SUBSCRIPTIONS_COLLECTION"]
-        client = MongoClient(MONGO_URI)
-        db = client[DB_NAME]
-        collection = db[SUBSCRIPTIONS_COLLECTION]
+        collection = get_subscription_collection(get_db())
         return collection.find_one({'email': email})
     except Exception as e:
         st.error(f"Error fetching subscription details: {e}")
         return None
 
+@st.cache_resource
+def get_subscription_index():
+    """One SubscriptionIndex shared by every session; refreshed incrementally on use."""
+    return SubscriptionIndex(get_subscription_collection(get_db()))
+
+def get_watcher_counts(locations):
+    """Returns {location: number of subscribed users} for the given locations."""
+    try:
+        index = get_subscription_index()
+        index.refresh()
+        return {location: index.watcher_count(location) for location in locations}
+    except Exception as e:
+        st.error(f"Error fetching subscriber counts: {e}")
+        return {}
+
+@st.cache_data(max_entries=2, show_spinner=False)
+def get_location_centers(version):
+    """Median coordinates of each reported location, used as the centers of radius alerts."""
+    centers = load_query_engine().frame.groupby('Location', observed=True)[['Latitude', 'Longitude']].median()
+    return {location: (float(lat), float(lon)) for location, (lat, lon) in centers.iterrows()}
+
 def send_subscription_email(email_receiver):
     # (This function remains unchanged)
     if not email_receiver: return False
@@ -49,20 +66,16 @@ def send_subscription_email(email_receiver):
         return True
     except Exception as e: st.error(f"Failed to send confirmation email: {e}"); return False
 
-def save_subscription(email, events, locations):
-    # (This function remains unchanged)
+def save_subscription(email, events, locations, areas=None):
+    """Saves the subscription; `areas` are {'name', 'lat', 'lon', 'radius_km'} dicts for radius alerts."""
     try:
-        MONGO_URI = st.secrets["MONGO_URI"]
-        DB_NAME = st.secrets["DB_NAME"]
-        SUBSCRIPTIONS_COLLECTION = st.secrets["SUBSCRIPTIONS_COLLECTION"]
+        collection = get_subscription_collection(get_db())
     except KeyError as e: st.error(f"🔥 DB credentials missing: {e}"); return False
     try:
-        client = MongoClient(MONGO_URI)
-        db = client[DB_NAME]
-        collection = db[SUBSCRIPTIONS_COLLECTION]
         collection.update_one(
             {'email': email},
-            {'$set': {"email": email, "selected_events": events, "selected_locations": locations, "subscribed_at": datetime.now(timezone.utc)}},
+            {'$set': {"email": email, "selected_events": events, "selected_locations": locations,
+                      "selected_areas": areas or [], "subscribed_at": datetime.now(timezone.utc)}},
             upsert=True
         )
         return True
@@ -95,6 +108,7 @@ def main():
             st.subheader("Your Current Subscription")
             subscribed_events = current_sub.get('selected_events', [])
             subscribed_locations = current_sub.get('selected_locations', [])
+            subscribed_areas = current_sub.get('selected_areas', [])
             
             if subscribed_events:
                 st.write("✅ **Events:**")
@@ -107,14 +121,19 @@ def main():
                 st.write(f"`{', '.join(subscribed_locations)}`")
             else:
                 st.write("❌ No locations subscribed.")
+
+            if subscribed_areas:
+                st.write("✅ **Areas:**")
+                area_labels = [f"{area['name']} (within {area['radius_km']:.0f} km)" for area in subscribed_areas]
+                st.write(f"`{', '.join(area_labels)}`")
     else:
         st.info("You do not have an active alert subscription yet.")
     # --- END: New Subscription Status Display ---
     
     st.divider()
 
-    df = load_data()
-    if df.empty: return
+    engine = load_query_engine()
+    if engine.frame.empty: return
     
     st.subheader("Update Your Preferences")
     
@@ -122,14 +141,35 @@ def main():
     default_events = current_sub.get('selected_events', []) if current_sub else []
     default_locations = current_sub.get('selected_locations', []) if current_sub else []
 
-    all_events = sorted(df["disaster_event"].unique())
+    all_events = engine.events
     selected_events = st.multiselect("Select Disaster Events:", options=all_events, default=default_events)
 
-    all_locations = sorted(df["Location"].unique())
+    all_locations = engine.locations
     selected_locations = st.multiselect("Select Locations:", options=all_locations, default=default_locations)
+    if selected_locations:
+        watchers = get_watcher_counts(selected_locations)
+        if watchers:
+            st.caption("👥 Users watching: " + ", ".join(f"{loc} ({count})" for loc, count in watchers.items()))
+
+    # Radius alerts match on coordinates, so they also catch reports that name a nearby
+    # city or region instead of the place that was picked (e.g. "Tokyo" vs "Japan").
+    centers = get_location_centers(engine.version)
+    default_areas = current_sub.get('selected_areas', []) if current_sub else []
+    selected_area_names = st.multiselect(
+        "Also alert me about events near:", options=all_locations,
+        default=[area['name'] for area in default_areas if area['name'] in centers]
+    )
+    radius_km = st.slider(
+        "Distance (km):", min_value=25, max_value=1000, step=25,
+        value=int(default_areas[0]['radius_km']) if default_areas else 250
+    )
+    selected_areas = [
+        {'name': name, 'lat': centers[name][0], 'lon': centers[name][1], 'radius_km': radius_km}
+        for name in selected_area_names if name in centers
+    ]
 
     if st.button("Update Subscription", type="primary"):
-        if save_subscription(user_email, selected_events, selected_locations):
+        if save_subscription(user_email, selected_events, selected_locations, selected_areas):
             if send_subscription_email(user_email):
                 st.success("Subscription updated successfully! A confirmation email has been sent.")
                 st.balloons()
@@ -2,18 +2,108 @@
 
 import streamlit as st
 import pandas as pd
+import numpy as np
 import folium
-from folium.plugins import MarkerCluster
+from folium.plugins import FastMarkerCluster, MarkerCluster
 from streamlit_folium import st_folium
-from datetime import datetime, timezone, timedelta
-from utils import load_data
+from datetime import timedelta
+from clustering import ClusterIndex, SpatialIndex, contains, expand_bounds, view_bounds
+from utils import load_query_engine
+
+DEFAULT_ZOOM = 4
+MAP_HEIGHT = 500
+
+# Builds each marker in the browser from a plain [lat, lon, popup, tooltip] row
+FAST_MARKER_CALLBACK = """
+function (row) {
+    var marker = L.marker(new L.LatLng(row[0], row[1]));
+    marker.bindPopup(row[2], {maxWidth: 300});
+    marker.bindTooltip(row[3]);
+    return marker;
+}
+"""
+
+# --- Map Helper Functions ---
+
+def popup_html(df):
+    """Builds the popup and tooltip text of every row at once."""
+    event = df['disaster_event'].astype(str)
+    popups = "<b>" + event + "</b><br><a href='" + df['url'].astype(str) + "' target='_blank'>" + df['title'].astype(str) + "</a>"
+    tooltips = event + " in " + df['Location'].astype(str)
+    return popups, tooltips
+
+def add_markers(mymap, df):
+    """One folium.Marker per row; only used for small selections."""
+    marker_cluster = MarkerCluster().add_to(mymap)
+    popups, tooltips = popup_html(df)
+    for lat, lon, popup, tooltip in zip(df['Latitude'], df['Longitude'], popups, tooltips):
+        folium.Marker(
+            location=[float(lat), float(lon)],
+            popup=folium.Popup(popup, max_width=300),
+            tooltip=tooltip
+        ).add_to(marker_cluster)
+
+def add_fast_markers(mymap, df):
+    """Ships the rows as one data array and lets the browser build and cluster the markers."""
+    popups, tooltips = popup_html(df)
+    data = [list(row) for row in zip(df['Latitude'].astype(float), df['Longitude'].astype(float), popups, tooltips)]
+    FastMarkerCluster(data, callback=FAST_MARKER_CALLBACK).add_to(mymap)
+
+def add_clusters(mymap, index, zoom, box):
+    """Draws the server-side clusters for `zoom` inside `box`: a marker per single event, a sized circle per group."""
+    layer = folium.FeatureGroup(name='Events').add_to(mymap)
+    clusters = index.clusters(zoom)
+    south, west, north, east = box
+    lon = clusters['Longitude'] if east - west >= 360 else (clusters['Longitude'] - west) % 360 + west
+    clusters = clusters[clusters['Latitude'].between(south, north) & lon.between(west, east)]
+    shown = np.unique(np.concatenate(clusters['members'].to_numpy())) if len(clusters) else np.array([], dtype='int64')
+    popups, tooltips = popup_html(index.frame.iloc[shown])
+    popups, tooltips = dict(zip(shown, popups)), dict(zip(shown, tooltips))
+    for lat, lon, count, members in clusters.itertuples(index=False):
+        if count == 1:
+            row = members[0]
+            folium.Marker(
+                location=[lat, lon],
+                popup=folium.Popup(popups[row], max_width=300),
+                tooltip=tooltips[row]
+            ).add_to(layer)
+        else:
+            latest = "<br>".join(popups[row] for row in members)
+            folium.CircleMarker(
+                location=[lat, lon],
+                radius=8 + 4 * np.log10(count),
+                color='#d9480f', fill=True, fill_opacity=0.6,
+                popup=folium.Popup(f"<b>{count} events</b> (latest shown)<br>{latest}", max_width=300),
+                tooltip=f"{count} events - zoom in to see them"
+            ).add_to(layer)
+
+def read_map_view(state):
+    """Returns the center, zoom and (south, west, north, east) bounds reported by st_folium, or None."""
+    try:
+        south_west, north_east = state['bounds']['_southWest'], state['bounds']['_northEast']
+        bounds = (south_west['lat'], south_west['lng'], north_east['lat'], north_east['lng'])
+        view = {'center': (state['center']['lat'], state['center']['lng']), 'zoom': int(state['zoom']), 'bounds': bounds}
+    except (KeyError, TypeError):
+        return None
+    return None if None in bounds + view['center'] else view
+
+@st.cache_resource(max_entries=2)
+def get_spatial_index(_frame, version):
+    """Bounding-box index over the whole dataset, built once per data version."""
+    return SpatialIndex(_frame)
+
+@st.cache_resource(max_entries=8)
+def get_cluster_index(_frame, version, start_date, end_date, events):
+    """Cluster index of the current selection, cached per data version and filter."""
+    return ClusterIndex(_frame)
 
 def main():
     st.title("🌍 Real-Time Disaster Monitor")
     st.markdown("An interactive map showing recent disaster events reported worldwide.")
 
     with st.spinner('Loading global disaster data, please wait...'):
-        df = load_data()
+        engine = load_query_engine()
+        df, version = engine.frame, engine.version
 
     if df.empty:
         st.info("There is currently no disaster data to display.")
@@ -22,8 +112,8 @@ def main():
     # --- Sidebar Filters ---
     st.sidebar.header('🗺️ Map Filters')
     
-    min_date = df['timestamp'].min().date()
-    max_date = df['timestamp'].max().date()
+    min_date = engine.min_date
+    max_date = engine.max_date
     default_start_date = max_date - timedelta(days=7)
     
     if default_start_date < min_date:
@@ -32,21 +122,12 @@ def main():
     start_date = st.sidebar.date_input("Start date", default_start_date, min_value=min_date, max_value=max_date)
     end_date = st.sidebar.date_input("End date", max_date, min_value=start_date, max_value=max_date)
 
-    start_date_utc = datetime.combine(start_date, datetime.min.time()).replace(tzinfo=timezone.utc)
-    end_date_utc = datetime.combine(end_date, datetime.max.time()).replace(tzinfo=timezone.utc)
-
-    unique_events = sorted(df["disaster_event"].unique())
+    unique_events = engine.events
     selected_events = st.multiselect("Filter by Disaster Events", ["All"] + unique_events, default=["All"])
 
-    # Apply filters
-    if "All" in selected_events:
-        filtered_df = df[(df['timestamp'] >= start_date_utc) & (df['timestamp'] <= end_date_utc)]
-    else:
-        filtered_df = df[
-            (df['timestamp'] >= start_date_utc) & 
-            (df['timestamp'] <= end_date_utc) &
-            (df['disaster_event'].isin(selected_events))
-        ]
+    # Apply filters (binary search on time plus per-event row lists; see query.py)
+    positions = engine.positions(start_date, end_date, None if "All" in selected_events else selected_events)
+    filtered_df = df.iloc[positions]
 
     # --- Key Metrics ---
     st.divider()
@@ -61,8 +142,22 @@ def main():
     if filtered_df.empty:
         st.warning("No disaster data available for the selected filters.")
     else:
-        map_center = (filtered_df['Latitude'].mean(), filtered_df['Longitude'].mean())
-        mymap = folium.Map(location=map_center, zoom_start=4)
+        # Small selections are sent whole. Larger ones are cut down to the visible area
+        # (plus a margin), then drawn as markers, browser-side clusters, or server-side
+        # clusters for the current zoom level, depending on how many events are in view.
+        marker_limit = int(st.secrets.get("MAP_MARKER_LIMIT", 500))
+        fast_cluster_limit = int(st.secrets.get("MAP_FAST_CLUSTER_LIMIT", 20000))
+        margin = float(st.secrets.get("MAP_VIEWPORT_MARGIN", 0.25))
+        viewport = len(filtered_df) > marker_limit
+
+        view = st.session_state.get('home_map_view') if viewport else None
+        if view:
+            map_center, zoom, bounds = view['center'], view['zoom'], view['bounds']
+        else:
+            map_center, zoom = (float(filtered_df['Latitude'].mean()), float(filtered_df['Longitude'].mean())), DEFAULT_ZOOM
+            bounds = view_bounds(map_center, zoom, height=MAP_HEIGHT)
+        box = expand_bounds(bounds, margin)
+        mymap = folium.Map(location=map_center, zoom_start=zoom)
         
         # --- START: NEW Map Layer Code ---
         # Add multiple map styles (Tile Layers) to the map object.
@@ -72,21 +167,35 @@ def main():
         folium.TileLayer('Esri.WorldImagery', name='Satellite View').add_to(mymap)
         # --- END: NEW Map Layer Code ---
 
-        marker_cluster = MarkerCluster().add_to(mymap)
-        for index, row in filtered_df.iterrows():
-            popup_content = f"<b>{row['disaster_event']}</b><br><a href='{row['url']}' target='_blank'>{row['title']}</a>"
-            folium.Marker(
-                location=[row['Latitude'], row['Longitude']],
-                popup=folium.Popup(popup_content, max_width=300),
-                tooltip=f"{row['disaster_event']} in {row['Location']}"
-            ).add_to(marker_cluster)
+        if not viewport:
+            add_markers(mymap, filtered_df)
+        else:
+            in_view = get_spatial_index(df, version).query(*box)
+            visible_df = df.iloc[np.intersect1d(in_view, positions, assume_unique=True)]
+            if len(visible_df) <= marker_limit:
+                add_markers(mymap, visible_df)
+            elif len(visible_df) <= fast_cluster_limit:
+                add_fast_markers(mymap, visible_df)
+            else:
+                index = get_cluster_index(filtered_df, version, start_date, end_date, tuple(selected_events))
+                add_clusters(mymap, index, zoom, box)
 
         # --- START: Add Layer Control to the Map ---
         # This adds the button that lets the user switch between the layers we defined above.
         folium.LayerControl().add_to(mymap)
         # --- END: Add Layer Control to the Map ---
         
-        st_folium(mymap, width='100%', height=500)
+        # Only a viewport-limited map needs to hear about pans and zooms
+        state = st_folium(
+            mymap, key='home_map', width='100%', height=MAP_HEIGHT,
+            returned_objects=['zoom', 'center', 'bounds'] if viewport else [],
+        )
+        new_view = read_map_view(state) if viewport else None
+        if new_view:
+            st.session_state['home_map_view'] = new_view
+            # Redraw only once the user zooms or pans past the margin that was already sent
+            if new_view['zoom'] != zoom or not contains(box, new_view['bounds']):
+                st.rerun()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
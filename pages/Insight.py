@@ -5,7 +5,36 @@ import pandas as pd
 import plotly.express as px
 from wordcloud import WordCloud
 from datetime import timedelta
-from utils import load_data
+from utils import load_query_engine
+from rollups import headline_terms, load_rollups, load_terms, merge_terms
+from series import build_series
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def time_series(start_date, end_date, by_event, max_points, version):
+    """The volume series for a filter, bucketed to at most `max_points` points per series (see series.py)."""
+    return build_series(load_rollups().select(start_date, end_date)[0], start_date, end_date, max_points=max_points, by_event=by_event)
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def render_wordcloud(start_date, end_date, version):
+    """
+    Renders the word cloud of the selected days from the per-day term index.
+    Days the index does not cover are counted from their headlines instead.
+    The image is cached per date range and data version, keeping the 32 most
+    recently used.
+    """
+    indexed = load_terms(start_date, end_date)
+    rows = load_query_engine().select(start_date, end_date)
+    missing = rows[~rows['date'].dt.date.isin(set(indexed))]
+    term_counts = list(indexed.values())
+    if not missing.empty:
+        term_counts.append(headline_terms(missing['title'].dropna()))
+    frequencies = merge_terms(term_counts)
+    if not frequencies:
+        return None
+    wordcloud = WordCloud(
+        width=800, height=300, background_color='white', collocations=False
+    ).generate_from_frequencies(frequencies)
+    return wordcloud.to_array()
 
 def main():
     # --- Page Title and Introduction ---
@@ -14,18 +43,16 @@ def main():
 
     # --- Data Loading with Spinner ---
     with st.spinner('Analyzing data, please wait...'):
-        df = load_data()
+        engine = load_query_engine()
 
-    if df.empty:
+    if engine.frame.empty:
         st.info("There is currently no data available to generate insights.")
         return
         
-    df['date'] = df['timestamp'].dt.date
-
     # --- Sidebar Filters for Analytics ---
     st.sidebar.header('📈 Analytics Filters')
-    min_date = df['date'].min()
-    max_date = df['date'].max()
+    min_date = engine.min_date
+    max_date = engine.max_date
 
     default_start_date = max_date - timedelta(days=30)
     if default_start_date < min_date:
@@ -38,19 +65,23 @@ def main():
         "End date for Insights", max_date, min_value=start_date, max_value=max_date, key="insight_end"
     )
     
-    filtered_df = df[(df['date'] >= start_date) & (df['date'] <= end_date)]
+    # A slice of the time-sorted dataset, found by binary search
+    filtered_df = engine.select(start_date, end_date)
 
     if filtered_df.empty:
         st.warning("No data found in the selected date range.")
         return
 
+    # Per-day counts built once per data version, so these charts cost in proportion to days, not articles
+    event_days, location_days = load_rollups().select(start_date, end_date)
+
     # --- START: New Chart Layout using Columns ---
     st.divider()
     col1, col2 = st.columns(2, gap="large") # Use a large gap for better spacing
 
     with col1:
         st.subheader("Top 10 Affected Locations")
-        location_counts = filtered_df['Location'].value_counts().nlargest(10)
+        location_counts = location_days.groupby('Location', observed=True)['count'].sum().nlargest(10)
         
         fig_loc = px.bar(
             location_counts,
@@ -66,7 +97,7 @@ def main():
     
     with col2:
         st.subheader("Disaster Event Proportions")
-        event_counts = filtered_df['disaster_event'].value_counts()
+        event_counts = event_days.groupby('disaster_event', observed=True)['count'].sum()
         
         fig_event = px.pie(
             event_counts,
@@ -82,15 +113,18 @@ def main():
     st.divider()
 
     st.subheader("Disaster Reports Over Time")
-    # Group data by day and count the number of events
-    time_counts = filtered_df.set_index('timestamp').resample('D').size().reset_index(name='count')
+    by_event = st.checkbox("Break down by event type", key="insight_by_event")
+    # Daily, weekly or monthly buckets depending on the range, so the figure stays small
+    max_points = int(st.secrets.get("INSIGHT_MAX_POINTS", 366))
+    time_counts, bucket = time_series(start_date, end_date, by_event, max_points, engine.version)
     
     fig_time = px.area(
         time_counts, 
         x='timestamp', 
         y='count',
-        labels={'timestamp': 'Date', 'count': 'Daily Event Count'},
-        title="Daily Volume of Disaster Reports"
+        color='disaster_event' if by_event else None,
+        labels={'timestamp': 'Date', 'count': f'{bucket} Event Count', 'disaster_event': 'Event'},
+        title=f"{bucket} Volume of Disaster Reports"
     )
     st.plotly_chart(fig_time, use_container_width=True)
 
@@ -98,13 +132,10 @@ def main():
     # --- END: New Chart Layout ---
     
     st.subheader("Common Terms in Disaster Headlines")
-    text_data = ' '.join(title for title in filtered_df['title'].dropna())
+    image = render_wordcloud(start_date, end_date, engine.version)
     
-    if text_data:
-        wordcloud = WordCloud(
-            width=800, height=300, background_color='white', collocations=False
-        ).generate(text_data)
-        st.image(wordcloud.to_array(), use_container_width=True)
+    if image is not None:
+        st.image(image, use_container_width=True)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,111 @@
+# pipeline.py
+
+import queue
+import threading
+import time
+
+_END = object()  # Marks the end of the stream on a queue
+
+class Stage:
+    """
+    One step of a streaming pipeline. `func` is called with each input item and
+    returns an iterable of output items (a list, a generator, or None for no
+    output). `workers` threads run `func` concurrently. The stage's input queue
+    holds at most `queue_size` items, so a slow stage blocks the stages feeding
+    it instead of letting work pile up in memory.
+    """
+
+    def __init__(self, name, func, workers=1, queue_size=64):
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+        self.queue_size = queue_size
+
+    def start(self, inbox, outbox, errors):
+        remaining = [self.workers]
+        lock = threading.Lock()
+
+        def work():
+            while True:
+                item = inbox.get()
+                if item is _END:
+                    inbox.put(_END)  # Let the sibling workers see it too
+                    break
+                try:
+                    for output in self.func(item) or ():
+                        if outbox is not None:
+                            outbox.put(output)
+                except Exception as e:
+                    errors.append((self.name, e))
+                    print(f"   [{self.name} Error] {e}")
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last and outbox is not None:
+                outbox.put(_END)
+
+        threads = [threading.Thread(target=work, name=f"{self.name}-{i}", daemon=True) for i in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        return threads
+
+
+class Batch(Stage):
+    """
+    Groups single items into lists of up to `size` items. A partial batch is
+    sent on once its oldest item has waited `max_wait` seconds, so that a
+    trickle of items still moves through the pipeline promptly.
+    """
+
+    def __init__(self, name, size, max_wait=2.0, queue_size=64):
+        super().__init__(name, func=None, workers=1, queue_size=queue_size)
+        self.size = max(1, size)
+        self.max_wait = max_wait
+
+    def start(self, inbox, outbox, errors):
+        def work():
+            buffer = []
+            deadline = None
+            while True:
+                timeout = None if not buffer else max(0.0, deadline - time.monotonic())
+                try:
+                    item = inbox.get(timeout=timeout)
+                except queue.Empty:
+                    outbox.put(buffer)
+                    buffer = []
+                    continue
+                if item is _END:
+                    if buffer:
+                        outbox.put(buffer)
+                    outbox.put(_END)
+                    break
+                buffer.append(item)
+                if len(buffer) == 1:
+                    deadline = time.monotonic() + self.max_wait
+                if len(buffer) >= self.size:
+                    outbox.put(buffer)
+                    buffer = []
+
+        thread = threading.Thread(target=work, name=self.name, daemon=True)
+        thread.start()
+        return [thread]
+
+
+def run_pipeline(source, stages):
+    """
+    Streams every item of `source` through `stages`, in order, and blocks until
+    the last stage has finished. Outputs of the last stage are discarded, so it
+    should write its results somewhere. Returns the list of (stage name,
+    exception) pairs for items that failed.
+    """
+    queues = [queue.Queue(maxsize=stage.queue_size) for stage in stages] + [None]
+    errors = []
+    threads = []
+    for i, stage in enumerate(stages):
+        threads.extend(stage.start(queues[i], queues[i + 1], errors))
+    for item in source:
+        queues[0].put(item)
+    queues[0].put(_END)
+    for thread in threads:
+        thread.join()
+    return errors
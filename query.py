@@ -0,0 +1,78 @@
+# query.py
+
+import numpy as np
+import pandas as pd
+
+class QueryEngine:
+    """
+    Read-only filter engine over one version of the dashboard dataset.
+
+    The rows are sorted by timestamp once, so a date range is a slice found
+    by binary search, and each event type keeps the sorted positions of its
+    rows. A query therefore costs in proportion to the rows it returns
+    rather than to the whole history. Build a new engine when the data
+    version changes (see utils.load_query_engine).
+    """
+
+    def __init__(self, frame, version=0):
+        order = np.argsort(frame['timestamp'].to_numpy(dtype='datetime64[us]'), kind='stable')
+        self.frame = frame.take(order).reset_index(drop=True)
+        self.version = version
+        self.times = self.frame['timestamp'].to_numpy(dtype='datetime64[us]')
+        codes = self.frame['disaster_event'].cat.codes.to_numpy()
+        by_code = np.argsort(codes, kind='stable')  # Stable, so each event's rows stay in time order
+        bounds = np.searchsorted(codes[by_code], np.arange(len(self.frame['disaster_event'].cat.categories) + 1))
+        self.event_rows = {
+            event: by_code[bounds[code]:bounds[code + 1]]
+            for code, event in enumerate(self.frame['disaster_event'].cat.categories)
+            if bounds[code + 1] > bounds[code]
+        }
+        self.events = sorted(self.event_rows)
+        self.locations = sorted(self.frame['Location'].dropna().unique())
+
+    def __len__(self):
+        return len(self.frame)
+
+    @property
+    def min_date(self):
+        return pd.Timestamp(self.times[0]).date()
+
+    @property
+    def max_date(self):
+        return pd.Timestamp(self.times[-1]).date()
+
+    def _day_range(self, start_date, end_date):
+        """Returns the [lo, hi) row range of the UTC days start_date..end_date (either may be None)."""
+        lo = 0 if start_date is None else np.searchsorted(self.times, np.datetime64(start_date, 'D'), side='left')
+        hi = len(self.times) if end_date is None else np.searchsorted(
+            self.times, np.datetime64(end_date, 'D') + np.timedelta64(1, 'D'), side='left'
+        )
+        return int(lo), int(hi)
+
+    def positions(self, start_date=None, end_date=None, events=None):
+        """
+        Returns the sorted row positions (in self.frame) of the rows reported
+        on the UTC days start_date..end_date, inclusive, whose disaster_event
+        is in `events`. None means no limit on that filter.
+        """
+        lo, hi = self._day_range(start_date, end_date)
+        if events is None:
+            return np.arange(lo, hi)
+        parts = []
+        for event in events:
+            rows = self.event_rows.get(event)
+            if rows is not None:
+                parts.append(rows[np.searchsorted(rows, lo):np.searchsorted(rows, hi)])
+        if not parts:
+            return np.array([], dtype='int64')
+        return parts[0] if len(parts) == 1 else np.sort(np.concatenate(parts))
+
+    def select(self, start_date=None, end_date=None, events=None):
+        """
+        Returns the matching rows (see positions()) as a DataFrame. Without an
+        event filter the result is a slice of the shared frame, not a copy.
+        """
+        if events is None:
+            lo, hi = self._day_range(start_date, end_date)
+            return self.frame.iloc[lo:hi]
+        return self.frame.take(self.positions(start_date, end_date, events))
@@ -0,0 +1,66 @@
+# ratelimit.py
+
+import threading
+import time
+from functools import wraps
+
+# Requests per second and burst size for each external provider.
+# Nominatim's usage policy allows at most one request per second.
+DEFAULT_RATE_LIMITS = {
+    'nominatim': (1.0, 1),
+}
+
+class TokenBucket:
+    """
+    Thread-safe token bucket. Tokens refill at `rate` per second up to
+    `capacity`; each call to acquire() takes one token and blocks until it is
+    available, so callers sharing a bucket never exceed the configured rate.
+    """
+
+    def __init__(self, rate, capacity=1):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = float(rate)
+        self.capacity = float(max(capacity, 1))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """Takes `tokens` from the bucket, sleeping if needed. Returns the time waited."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # Reserve the tokens up front so concurrent callers queue up behind us
+            self._tokens -= tokens
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def wrap(self, func):
+        """Returns `func` wrapped so that every call first acquires a token."""
+        @wraps(func)
+        def limited(*args, **kwargs):
+            self.acquire()
+            return func(*args, **kwargs)
+        return limited
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def get_limiter(provider, rate=None, capacity=None):
+    """
+    Returns the process-wide bucket for `provider`, creating it on first use.
+    `rate` and `capacity` override DEFAULT_RATE_LIMITS when the bucket is created.
+    """
+    with _limiters_lock:
+        if provider not in _limiters:
+            default_rate, default_capacity = DEFAULT_RATE_LIMITS.get(provider, (1.0, 1))
+            _limiters[provider] = TokenBucket(
+                rate if rate is not None else default_rate,
+                capacity if capacity is not None else default_capacity,
+            )
+        return _limiters[provider]
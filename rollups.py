@@ -0,0 +1,165 @@
+# rollups.py
+
+import argparse
+import re
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import streamlit as st
+from pymongo import ASCENDING, ReplaceOne
+from wordcloud import STOPWORDS
+from wordcloud.tokenization import process_tokens
+
+from db import get_disaster_collection, get_state_collection, get_term_collection
+from utils import get_db, get_load_pipeline, load_query_engine
+
+TERM_INDEX_STATE_ID = 'term_index'  # Marks in the ingest state collection that every day has been indexed
+_STOPWORDS = {word.lower() for word in STOPWORDS}
+
+def _time_window(since):
+    if since is None:
+        return []
+    # Timestamps are stored as NewsAPI's ISO strings, which sort like dates
+    return [{'$match': {'$or': [
+        {'timestamp': {'$gte': since.strftime('%Y-%m-%d')}},
+        {'timestamp': {'$gte': since}},
+    ]}}]
+
+def _replace_days(target, operations, built_at, since):
+    # Write the recomputed documents, then drop the ones in the range that were not rewritten
+    target.create_index([('day', ASCENDING)], name='day')
+    for start in range(0, len(operations), 1000):
+        target.bulk_write(operations[start:start + 1000], ordered=False)
+    stale = {'built_at': {'$lt': built_at}}
+    if since is not None:
+        stale['day'] = {'$gte': since}
+    target.delete_many(stale)
+
+def _day_bounds(start_date, end_date):
+    start = datetime.combine(start_date, datetime.min.time()).replace(tzinfo=timezone.utc)
+    end = datetime.combine(end_date, datetime.min.time()).replace(tzinfo=timezone.utc) + timedelta(days=1)
+    return start, end
+
+class DailyRollups:
+    """
+    Per-day counts of the dashboard dataset, by disaster_event and by
+    Location. Built once per data version (see load_rollups), so a chart over
+    a date range reads (days x events) or (days x locations) rows rather
+    than every article in the range.
+    """
+
+    def __init__(self, frame):
+        self.by_event = self._count(frame, 'disaster_event')
+        self.by_location = self._count(frame, 'Location')
+        self._event_days = self.by_event['day'].to_numpy(dtype='datetime64[us]')
+        self._location_days = self.by_location['day'].to_numpy(dtype='datetime64[us]')
+
+    @staticmethod
+    def _count(frame, column):
+        counts = frame.groupby(['date', column], observed=True).size()
+        counts = counts[counts > 0].rename('count').reset_index().rename(columns={'date': 'day'})
+        return counts.sort_values('day', kind='stable', ignore_index=True)
+
+    @staticmethod
+    def _slice(table, days, start_date, end_date):
+        lo = np.searchsorted(days, np.datetime64(start_date, 'D'), side='left')
+        hi = np.searchsorted(days, np.datetime64(end_date, 'D') + np.timedelta64(1, 'D'), side='left')
+        return table.iloc[lo:hi]
+
+    def select(self, start_date, end_date):
+        """
+        Returns (by_event, by_location) for the UTC days start_date..end_date,
+        inclusive: (day, disaster_event, count) and (day, Location, count) rows.
+        """
+        return (self._slice(self.by_event, self._event_days, start_date, end_date),
+                self._slice(self.by_location, self._location_days, start_date, end_date))
+
+@st.cache_resource(max_entries=2)
+def _build_rollups(_frame, version):
+    return DailyRollups(_frame)
+
+def load_rollups():
+    """Returns the DailyRollups of the current dataset, shared by every session like the query engine."""
+    engine = load_query_engine()
+    return _build_rollups(engine.frame, engine.version)
+
+# --- Headline Term Index ---
+
+def headline_terms(titles):
+    """
+    Counts the terms in `titles` the way WordCloud.generate does with
+    collocations off: words without a trailing 's, numbers or stopwords,
+    plurals folded into singulars and each word in its most common case.
+    """
+    words = re.findall(r"\w[\w']*", ' '.join(title for title in titles if title))
+    words = [word[:-2] if word.lower().endswith("'s") else word for word in words]
+    words = [word for word in words if not word.isdigit() and word.lower() not in _STOPWORDS]
+    counts, _ = process_tokens(words)
+    return counts
+
+def merge_terms(term_counts):
+    """Sums several term count dicts, treating case variants (e.g. 'Flood', 'flood') as one term."""
+    merged = {}
+    for counts in term_counts:
+        for term, count in counts.items():
+            entry = merged.setdefault(term.lower(), [term, 0])
+            entry[1] += count
+    return dict(merged.values())
+
+def term_index_built(state_collection):
+    """True once the term index has been built for every day (a run of update_term_index with since=None)."""
+    return state_collection.find_one({'_id': TERM_INDEX_STATE_ID}) is not None
+
+def update_term_index(collection, term_collection, since=None, max_terms=500, state_collection=None):
+    """
+    Recomputes the per-day headline term counts from `since` onwards (or for
+    every day), keeping each day's `max_terms` most frequent terms. Uses the
+    same cleaned rows as the dashboard. A full rebuild is recorded in
+    `state_collection`, if given (see term_index_built). Returns the number
+    of days written.
+    """
+    built_at = datetime.now(timezone.utc)
+    pipeline = _time_window(since) + get_load_pipeline() + [
+        {'$group': {
+            '_id': {'$dateToString': {'format': '%Y-%m-%d', 'date': '$timestamp'}},
+            'titles': {'$push': '$title'},
+        }},
+    ]
+    operations = []
+    for doc in collection.aggregate(pipeline, allowDiskUse=True):
+        counts = headline_terms(doc['titles'])
+        top = dict(sorted(counts.items(), key=lambda item: item[1], reverse=True)[:max_terms])
+        operations.append(ReplaceOne(
+            {'_id': doc['_id']},
+            {'day': datetime.strptime(doc['_id'], '%Y-%m-%d').replace(tzinfo=timezone.utc),
+             'terms': top, 'built_at': built_at},
+            upsert=True
+        ))
+    _replace_days(term_collection, operations, built_at, since)
+    if since is None and state_collection is not None:
+        state_collection.update_one({'_id': TERM_INDEX_STATE_ID}, {'$set': {'built_at': built_at}}, upsert=True)
+    return len(operations)
+
+def load_terms(start_date, end_date):
+    """
+    Returns {date: term counts} for the indexed UTC days in start_date..end_date.
+    Days missing from the result have not been indexed (yet).
+    """
+    start, end = _day_bounds(start_date, end_date)
+    docs = get_term_collection(get_db()).find({'day': {'$gte': start, '$lt': end}}, {'day': 1, 'terms': 1})
+    return {doc['day'].date(): doc['terms'] for doc in docs}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the per-day headline term index used by the Insight word cloud.")
+    parser.add_argument('--days', type=int, default=None,
+                        help="Only rebuild this many most recent days (default: rebuild everything)")
+    args = parser.parse_args()
+
+    since = None
+    if args.days is not None:
+        today = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+        since = today - timedelta(days=args.days - 1)
+    days = update_term_index(get_disaster_collection(), get_term_collection(), since=since,
+                             state_collection=get_state_collection())
+    print(f"Term index rebuilt{'' if since is None else f' since {since.date()}'}: {days} day(s).")
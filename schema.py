@@ -0,0 +1,54 @@
+# schema.py
+
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+# Low-cardinality text columns stored as categories (one small integer code per row)
+CATEGORICAL_COLUMNS = ['disaster_event', 'Location', 'source']
+COORDINATE_COLUMNS = ['Latitude', 'Longitude']
+
+def apply_schema(df):
+    """
+    Converts a dashboard frame to its compact representation: categorical
+    dtypes for CATEGORICAL_COLUMNS, float32 coordinates (about 1 m precision)
+    and timezone-aware UTC timestamps. Also adds the derived 'date' column
+    (timestamp floored to the UTC day) so pages never compute it per rerun.
+    """
+    df = df.copy()
+    for column in CATEGORICAL_COLUMNS:
+        if column in df and not isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype('category')
+    for column in COORDINATE_COLUMNS:
+        if column in df:
+            df[column] = df[column].astype('float32')
+    if 'timestamp' in df:
+        df['timestamp'] = pd.to_datetime(df['timestamp'], utc=True)
+        df['date'] = df['timestamp'].dt.floor('D')
+    return df
+
+def concat_typed(frames):
+    """
+    Concatenates frames that went through apply_schema() and keeps the
+    categorical columns categorical. A plain pd.concat falls back to object
+    dtype when the category sets differ.
+    """
+    frames = [frame for frame in frames if not frame.empty]
+    if len(frames) <= 1:
+        return frames[0] if frames else pd.DataFrame()
+    merged = {}
+    for column in CATEGORICAL_COLUMNS:
+        if all(column in frame for frame in frames):
+            merged[column] = union_categoricals([frame[column] for frame in frames])
+    df = pd.concat([frame.drop(columns=list(merged)) for frame in frames], ignore_index=True)
+    for column, values in merged.items():
+        df[column] = values
+    return df[frames[0].columns]
+
+def memory_report(df):
+    """Returns a printable summary of the frame's memory use, in total and per row."""
+    usage = df.memory_usage(deep=True, index=False)
+    rows = max(len(df), 1)
+    lines = [f"{len(df)} rows, {usage.sum() / 1024 ** 2:.2f} MiB, {usage.sum() / rows:.0f} bytes/row"]
+    for column, size in usage.items():
+        lines.append(f"  {column:<15} {str(df[column].dtype):<22} {size / rows:8.1f} bytes/row")
+    return '\n'.join(lines)
@@ -0,0 +1,76 @@
+# series.py
+
+import numpy as np
+import pandas as pd
+
+# Bucket sizes tried in order
+FREQUENCIES = [('D', 'Daily'), ('W-MON', 'Weekly'), ('MS', 'Monthly')]
+
+def _resample(frame, freq):
+    return frame.resample(freq, label='left', closed='left')
+
+def choose_frequency(days, max_points):
+    """
+    Returns the finest (pandas frequency, label) whose buckets over `days` (a
+    daily DatetimeIndex) fit `max_points`, or None. Buckets are counted as
+    resample makes them, so the partial weeks or months at both ends count.
+    """
+    for freq, label in FREQUENCIES:
+        buckets = len(days) if freq == 'D' else len(_resample(pd.Series(0, index=days), freq).size())
+        if buckets <= max_points:
+            return freq, label
+    return None
+
+def lttb(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets downsampling. Returns the indices of
+    `threshold` points of (x, y), including the first and last, that keep
+    the visual shape of the line.
+    """
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype='float64')
+    y = np.asarray(y, dtype='float64')
+    edges = np.linspace(1, n - 1, threshold - 1).astype('int64')  # Buckets between the fixed end points
+    selected = [0]
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        # Average of the next bucket (or the last point) is the third triangle vertex
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x, avg_y = x[end:next_end].mean(), y[end:next_end].mean()
+        prev = selected[-1]
+        areas = np.abs((x[prev] - avg_x) * (y[start:end] - y[prev]) - (x[prev] - x[start:end]) * (avg_y - y[prev]))
+        selected.append(start + int(np.argmax(areas)))
+    selected.append(n - 1)
+    return np.asarray(selected)
+
+def build_series(rollups, start_date, end_date, max_points=366, by_event=False):
+    """
+    Turns daily rollup rows (day, disaster_event, count) into a time series of
+    at most `max_points` points per series. Days are summed into weekly or
+    monthly buckets when the range needs it; if even months do not fit, the
+    daily series is downsampled with LTTB (by the total, so stacked series
+    keep the same x values). Returns (long DataFrame with 'timestamp',
+    'count' and, if `by_event`, 'disaster_event'; bucket label).
+    """
+    days = pd.date_range(pd.Timestamp(start_date, tz='UTC'), pd.Timestamp(end_date, tz='UTC'), freq='D', name='timestamp')
+    keys = ['day', 'disaster_event'] if by_event else ['day']
+    daily = rollups.groupby(keys, observed=True)['count'].sum()
+    daily = (daily.unstack('disaster_event', fill_value=0) if by_event else daily.to_frame('count'))
+    daily = daily.reindex(days, fill_value=0)
+
+    choice = choose_frequency(days, max_points)
+    if choice:
+        freq, label = choice
+        series = daily if freq == 'D' else _resample(daily, freq).sum()
+    else:
+        label = 'Daily (downsampled)'
+        total = daily.sum(axis=1).to_numpy()
+        keep = lttb(np.arange(len(total)), total, max_points)
+        series = daily.iloc[keep]
+
+    series.index.name = 'timestamp'
+    if by_event:
+        return series.stack().rename('count').reset_index(), label
+    return series.reset_index(), label
@@ -0,0 +1,84 @@
+# snapshot.py
+
+import json
+import os
+from datetime import datetime, timezone
+
+import pyarrow as pa
+
+from schema import concat_typed
+
+MANIFEST_NAME = 'manifest.json'
+
+# --- Layout ---
+# A snapshot is a directory of Arrow IPC files (part-<version>.arrow), each
+# holding cleaned dashboard rows in the schema from schema.py, plus a
+# manifest.json listing the live parts in order and the largest MongoDB _id
+# they cover. Writers add a part, then atomically replace the manifest, so a
+# reader always sees a complete set of parts.
+
+def read_manifest(directory):
+    """Returns the snapshot manifest as a dict, or None if there is no snapshot."""
+    try:
+        with open(os.path.join(directory, MANIFEST_NAME), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _write_part(directory, name, frame):
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    tmp_path = os.path.join(directory, name + '.tmp')
+    # Uncompressed IPC so readers can memory-map the file
+    with pa.OSFile(tmp_path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, os.path.join(directory, name))
+
+def write_snapshot(directory, frame, last_id, replace=False):
+    """
+    Adds `frame` to the snapshot as a new part, or makes it the only part if
+    `replace` is true (or there is no snapshot yet), then swaps in the new
+    manifest. `last_id` is the largest _id the snapshot now covers. Parts
+    dropped from the manifest are deleted. Returns the new manifest.
+    """
+    os.makedirs(directory, exist_ok=True)
+    manifest = read_manifest(directory)
+    version = manifest['version'] + 1 if manifest else 1
+    parts = [] if replace or not manifest else list(manifest['parts'])
+    if not frame.empty or not parts:
+        name = f"part-{version:06d}.arrow"
+        _write_part(directory, name, frame)
+        parts.append(name)
+    new_manifest = {
+        'version': version,
+        'parts': parts,
+        'last_id': str(last_id) if last_id is not None else None,
+        'written_at': datetime.now(timezone.utc).isoformat(),
+    }
+    tmp_path = os.path.join(directory, MANIFEST_NAME + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(new_manifest, f, indent=2)
+    os.replace(tmp_path, os.path.join(directory, MANIFEST_NAME))
+
+    for name in os.listdir(directory):
+        if name.startswith('part-') and name not in parts:
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass  # Still open on a platform that cannot unlink open files; removed next time
+    return new_manifest
+
+def read_snapshot(directory, manifest=None):
+    """
+    Memory-maps the parts listed in the manifest and returns them as one
+    pandas DataFrame (parts in order, not de-duplicated), or None if there is
+    no snapshot. Categorical, float32 and UTC timestamp columns come back with
+    the same dtypes they were written with.
+    """
+    manifest = manifest or read_manifest(directory)
+    if not manifest:
+        return None
+    return concat_typed([
+        pa.ipc.open_file(pa.memory_map(os.path.join(directory, name))).read_all().to_pandas()
+        for name in manifest['parts']
+    ])
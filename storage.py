@@ -0,0 +1,101 @@
+# storage.py
+
+from datetime import timedelta
+
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import BulkWriteError, OperationFailure
+
+_indexed_collections = set()
+
+def ensure_indexes(collection):
+    """
+    Creates the indexes the disaster collection relies on. Runs once per
+    collection per process; create_index is a no-op for existing indexes.
+    """
+    if collection.full_name in _indexed_collections:
+        return
+    try:
+        collection.create_index([('url', ASCENDING)], unique=True, name='url_unique')
+    except OperationFailure as e:
+        # Usually duplicate URLs stored before the index existed
+        print(f"   [Index Warning] Could not create unique index on 'url': {e}")
+    collection.create_index([('timestamp', ASCENDING)], name='timestamp')
+    collection.create_index([('disaster_event', ASCENDING), ('Location', ASCENDING)], name='event_location')
+    collection.create_index([('related_urls', ASCENDING)], name='related_urls')
+    _indexed_collections.add(collection.full_name)
+
+def bulk_upsert(collection, records, batch_size=500):
+    """
+    Upserts records by URL using unordered bulk writes of `batch_size`
+    operations each. Returns a dict with 'inserted', 'updated' and 'unchanged'
+    counts.
+    """
+    ensure_indexes(collection)
+    counts = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+    for start in range(0, len(records), batch_size):
+        batch = records[start:start + batch_size]
+        operations = [UpdateOne({'url': record['url']}, {'$set': record}, upsert=True) for record in batch]
+        try:
+            result = collection.bulk_write(operations, ordered=False).bulk_api_result
+        except BulkWriteError as e:
+            # Unordered writes carry on past failures; count what was applied
+            result = e.details
+            print(f"   [Write Error] {len(result.get('writeErrors', []))} record(s) in this batch were not saved.")
+        counts['inserted'] += result.get('nUpserted', 0)
+        counts['updated'] += result.get('nModified', 0)
+        counts['unchanged'] += result.get('nMatched', 0) - result.get('nModified', 0)
+    return counts
+
+def find_existing_urls(collection, urls, batch_size=1000):
+    """
+    Returns the subset of `urls` already stored, either as an article or as a
+    near-duplicate linked to one, using batched $in queries on the url indexes.
+    """
+    urls = list(dict.fromkeys(urls))
+    existing = set()
+    for start in range(0, len(urls), batch_size):
+        chunk = urls[start:start + batch_size]
+        cursor = collection.find(
+            {'$or': [{'url': {'$in': chunk}}, {'related_urls': {'$in': chunk}}]},
+            {'url': 1, 'related_urls': 1, '_id': 0}
+        )
+        for doc in cursor:
+            existing.add(doc['url'])
+            existing.update(doc.get('related_urls', []))
+    return existing.intersection(urls)
+
+def link_duplicates(collection, links):
+    """
+    Attaches near-duplicate articles to their canonical record instead of
+    storing them as separate events. `links` is a list of (url, canonical_url).
+    """
+    if not links:
+        return
+    collection.bulk_write([
+        UpdateOne({'url': canonical_url}, {'$addToSet': {'related_urls': url}, '$inc': {'duplicate_count': 1}})
+        for url, canonical_url in links
+    ], ordered=False)
+
+# --- Per-keyword ingest watermarks ---
+
+def load_watermarks(state_collection, keywords, overlap_minutes=60):
+    """
+    Returns a dict of keyword -> datetime to pass as NewsAPI's `from`
+    parameter. The stored watermark is moved back by `overlap_minutes` so that
+    articles NewsAPI indexes late are still picked up; their URLs are skipped
+    if they turn out to be stored already.
+    """
+    docs = state_collection.find({'_id': {'$in': [f"newsapi:{keyword}" for keyword in keywords]}})
+    return {
+        doc['_id'].split(':', 1)[1]: doc['watermark'] - timedelta(minutes=overlap_minutes)
+        for doc in docs if doc.get('watermark')
+    }
+
+def save_watermarks(state_collection, latest):
+    """Advances each keyword's watermark to its newest fetched publish time, given as keyword -> Timestamp."""
+    if not latest:
+        return
+    state_collection.bulk_write([
+        UpdateOne({'_id': f"newsapi:{keyword}"}, {'$max': {'watermark': published.to_pydatetime()}}, upsert=True)
+        for keyword, published in latest.items()
+    ], ordered=False)
@@ -0,0 +1,143 @@
+# subscriptions.py
+
+import math
+import threading
+from collections import defaultdict
+
+EARTH_RADIUS_KM = 6371.0
+CELL_DEGREES = 1.0  # Grid cell size of the area index
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance in km between two points given in degrees."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi, dlambda = phi2 - phi1, math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+def _cell(lat, lon):
+    return int(math.floor((lat + 90.0) / CELL_DEGREES)), int(math.floor(((lon + 180.0) % 360.0) / CELL_DEGREES))
+
+def area_cells(lat, lon, radius_km):
+    """Returns the grid cells overlapped by the bounding box of a circle (a superset of the circle's cells)."""
+    dlat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    south, north = max(lat - dlat, -90.0), min(lat + dlat, 90.0 - 1e-9)
+    lat_rows = range(_cell(south, 0)[0], _cell(north, 0)[0] + 1)
+    widest = max(abs(south), abs(north))
+    columns = int(360.0 / CELL_DEGREES)
+    if widest >= 89.0 or dlat / math.cos(math.radians(widest)) >= 180.0:
+        lon_columns = range(columns)  # Reaches a pole or wraps the globe
+    else:
+        dlon = dlat / math.cos(math.radians(widest))
+        first, last = _cell(0, lon - dlon)[1], _cell(0, lon + dlon)[1]
+        lon_columns = range(first, last + 1) if first <= last else list(range(first, columns)) + list(range(last + 1))
+    return [(row, column) for row in lat_rows for column in lon_columns]
+
+
+class SubscriptionIndex:
+    """
+    Inverted index over the subscriptions collection, from each
+    (disaster_event, Location) pair to the emails subscribed to it, plus a
+    grid index over radius subscriptions ('selected_areas': centers with a
+    radius in km).
+
+    Matching a disaster by name is one dict lookup and costs in proportion to
+    the number of matching subscribers, however many subscriptions exist.
+    Matching by position only checks the areas registered in the disaster's
+    1-degree grid cell, so it does not grow with distant subscribers. The
+    first refresh() loads every subscription; later calls only re-read the
+    ones saved since (by 'subscribed_at'), so one index can be kept for the
+    life of a process and shared between threads.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.pairs = defaultdict(set)            # (event, location) -> emails
+        self.location_watchers = defaultdict(set)  # location -> emails
+        self.area_cells = defaultdict(set)       # grid cell -> (email, area number)
+        self.subscriptions = {}                  # email -> (events, locations, areas) currently indexed
+        self.updated_at = None
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.subscriptions)
+
+    def _remove(self, email):
+        events, locations, areas = self.subscriptions.pop(email, ((), (), ()))
+        for i, (lat, lon, radius_km) in enumerate(areas):
+            for cell in area_cells(lat, lon, radius_km):
+                members = self.area_cells.get(cell)
+                if members is not None:
+                    members.discard((email, i))
+                    if not members:
+                        del self.area_cells[cell]
+        for location in locations:
+            for event in events:
+                emails = self.pairs.get((event, location))
+                if emails is not None:
+                    emails.discard(email)
+                    if not emails:
+                        del self.pairs[(event, location)]
+            watchers = self.location_watchers.get(location)
+            if watchers is not None:
+                watchers.discard(email)
+                if not watchers:
+                    del self.location_watchers[location]
+
+    def add(self, subscription):
+        """Indexes one subscription document, replacing what was indexed for the same email."""
+        email = subscription.get('email')
+        if not email:
+            return
+        self._remove(email)
+        events = tuple(dict.fromkeys(subscription.get('selected_events') or []))
+        locations = tuple(dict.fromkeys(subscription.get('selected_locations') or []))
+        areas = tuple(
+            (float(area['lat']), float(area['lon']), float(area['radius_km']))
+            for area in subscription.get('selected_areas') or []
+        )
+        if not (events and (locations or areas)):
+            return
+        self.subscriptions[email] = (events, locations, areas)
+        for i, (lat, lon, radius_km) in enumerate(areas):
+            for cell in area_cells(lat, lon, radius_km):
+                self.area_cells[cell].add((email, i))
+        for location in locations:
+            self.location_watchers[location].add(email)
+            for event in events:
+                self.pairs[(event, location)].add(email)
+
+    def refresh(self):
+        """Loads the subscriptions saved since the last refresh (all of them the first time). Returns how many."""
+        with self.lock:
+            query = {} if self.updated_at is None else {'subscribed_at': {'$gte': self.updated_at}}
+            projection = {'_id': 0, 'email': 1, 'selected_events': 1, 'selected_locations': 1,
+                          'selected_areas': 1, 'subscribed_at': 1}
+            loaded = 0
+            for subscription in self.collection.find(query, projection):
+                self.add(subscription)
+                saved = subscription.get('subscribed_at')
+                if saved is not None and (self.updated_at is None or saved > self.updated_at):
+                    self.updated_at = saved
+                loaded += 1
+            return loaded
+
+    def match(self, event, location, lat=None, lon=None):
+        """
+        Returns the emails subscribed to `event` either in `location` or in an
+        area whose radius covers (lat, lon), when the coordinates are known.
+        """
+        emails = set(self.pairs.get((event, location), ()))
+        if lat is None or lon is None or math.isnan(lat) or math.isnan(lon):
+            return emails
+        for email, i in self.area_cells.get(_cell(lat, lon), ()):
+            if email in emails:
+                continue
+            events, _, areas = self.subscriptions[email]
+            center_lat, center_lon, radius_km = areas[i]
+            if event in events and haversine_km(lat, lon, center_lat, center_lon) <= radius_km:
+                emails.add(email)
+        return emails
+
+    def watcher_count(self, location):
+        """Returns how many users have `location` in their subscription."""
+        return len(self.location_watchers.get(location, ()))
@@ -1,48 +1,252 @@
 # utils.py
 
+import re
+import threading
+import time
 import streamlit as st
 import pandas as pd
-from pymongo import MongoClient
-from datetime import datetime
+from bson import ObjectId
+from datetime import datetime, timedelta
+from db import get_database, get_disaster_collection
+from query import QueryEngine
+from schema import apply_schema, concat_typed, memory_report
+from snapshot import read_manifest, read_snapshot, write_snapshot
+
+# Shared frames are handed to every session; copy-on-write keeps a page's
+# changes from leaking into them (always on from pandas 3.0)
+if int(pd.__version__.split('.')[0]) < 3:
+    pd.set_option('mode.copy_on_write', True)
+
+# Columns the dashboard pages use; nothing else is transferred from MongoDB
+LOAD_COLUMNS = ['title', 'disaster_event', 'timestamp', 'source', 'url', 'Location', 'Latitude', 'Longitude']
+
+# Default exclusion lists; override them with the EXCLUDE_* keys in secrets.toml
+DEFAULT_EXCLUDE_LOCATIONS = ['world', 'global', 'international', 'reuters', 'associated press']
+DEFAULT_EXCLUDE_KEYWORDS_IN_URL = ['politics', 'yahoo', 'sports', 'entertainment']
+DEFAULT_EXCLUDE_KEYWORDS_IN_TITLE = ['tool', 'angry', 'market']
+
+def _keyword_pattern(keywords):
+    return '|'.join(re.escape(keyword) for keyword in keywords) or '(?!)'  # '(?!)' never matches
+
+def build_load_pipeline(exclude_locations, exclude_keywords_in_url, exclude_keywords_in_title, after_id=None):
+    """
+    Builds the aggregation pipeline that cleans the disaster collection on the
+    server:
+
+    0. If `after_id` is given, keep only documents with a larger _id (a delta).
+    1. Project only LOAD_COLUMNS and parse 'timestamp' into a date.
+    2. Drop rows with an invalid timestamp or coordinates, an excluded location,
+       or an excluded keyword in the URL or title (case-insensitive).
+    3. Keep the first article per title, then the first per
+       (date, disaster_event, Location).
+    """
+    delta = [{'$match': {'_id': {'$gt': after_id}}}] if after_id is not None else []
+    return delta + [
+        {'$project': {column: 1 for column in LOAD_COLUMNS}},
+        {'$addFields': {
+            'timestamp': {'$convert': {'input': '$timestamp', 'to': 'date', 'onError': None, 'onNull': None}},
+        }},
+        {'$match': {
+            'timestamp': {'$ne': None},
+            'Latitude': {'$type': 'number', '$nin': [float('nan')]},
+            'Longitude': {'$type': 'number', '$nin': [float('nan')]},
+            '$expr': {'$and': [
+                {'$not': [{'$in': [{'$toLower': {'$ifNull': ['$Location', '']}}, [l.lower() for l in exclude_locations]]}]},
+                {'$not': [{'$regexMatch': {
+                    'input': {'$ifNull': ['$url', '']}, 'regex': _keyword_pattern(exclude_keywords_in_url), 'options': 'i'
+                }}]},
+                {'$not': [{'$regexMatch': {
+                    'input': {'$ifNull': ['$title', '']}, 'regex': _keyword_pattern(exclude_keywords_in_title), 'options': 'i'
+                }}]},
+            ]},
+        }},
+        {'$sort': {'_id': 1}},
+        {'$group': {'_id': '$title', 'doc': {'$first': '$$ROOT'}}},
+        {'$replaceRoot': {'newRoot': '$doc'}},
+        {'$sort': {'_id': 1}},
+        {'$group': {
+            '_id': {
+                'date': {'$dateToString': {'format': '%Y-%m-%d', 'date': '$timestamp'}},
+                'disaster_event': '$disaster_event',
+                'Location': '$Location',
+            },
+            'doc': {'$first': '$$ROOT'},
+        }},
+        {'$replaceRoot': {'newRoot': '$doc'}},
+        {'$sort': {'_id': 1}},
+    ]
+
+def get_load_pipeline(after_id=None):
+    """Returns the cleaning pipeline built from the exclusion lists in secrets (or the defaults)."""
+    return build_load_pipeline(
+        list(st.secrets.get("EXCLUDE_LOCATIONS", DEFAULT_EXCLUDE_LOCATIONS)),
+        list(st.secrets.get("EXCLUDE_KEYWORDS_IN_URL", DEFAULT_EXCLUDE_KEYWORDS_IN_URL)),
+        list(st.secrets.get("EXCLUDE_KEYWORDS_IN_TITLE", DEFAULT_EXCLUDE_KEYWORDS_IN_TITLE)),
+        after_id=after_id,
+    )
+
+def dedupe_frame(df):
+    """Applies the pipeline's de-duplication rules to a frame (used when merging a delta)."""
+    df = df.drop_duplicates(subset='url', keep='first')
+    df = df.drop_duplicates(subset='title', keep='first')
+    return df[~df.duplicated(subset=['date', 'disaster_event', 'Location'])]
+
+def fetch_clean_frame(collection, after_id=None):
+    """Runs the cleaning pipeline (optionally on a delta) and returns the rows, with _id, in the compact schema."""
+    docs = list(collection.aggregate(get_load_pipeline(after_id), allowDiskUse=True))
+    return apply_schema(pd.DataFrame(docs, columns=['_id'] + LOAD_COLUMNS))
+
+def overlap_id(last_id, overlap_seconds):
+    """Returns the ObjectId `overlap_seconds` before `last_id`, where a delta fetch starts."""
+    return ObjectId.from_datetime(last_id.generation_time - timedelta(seconds=overlap_seconds))
+
+def get_snapshot_dir():
+    """
+    Returns the snapshot directory from secrets (SNAPSHOT_DIR), or None when
+    it is not set. Snapshots are opt-in: they only help where the collector
+    and the dashboard share a disk, and on an ephemeral runner every run
+    would rebuild them from scratch.
+    """
+    return st.secrets.get("SNAPSHOT_DIR") or None
+
+def update_snapshot(collection, directory, max_parts=24, overlap_seconds=120):
+    """
+    Brings the columnar snapshot in `directory` up to date with MongoDB (run
+    by the collector after each cycle). The first run writes the whole cleaned
+    dataset; later runs append only the delta since the snapshot's last _id.
+    Once there are `max_parts` parts they are merged into one locally.
+    Returns the new manifest.
+    """
+    manifest = read_manifest(directory)
+    if not manifest or not manifest['last_id']:
+        df = fetch_clean_frame(collection)
+        last_id = df['_id'].max() if not df.empty else None
+        return write_snapshot(directory, df.drop(columns=['_id']), last_id, replace=True)
+
+    last_id = ObjectId(manifest['last_id'])
+    delta = fetch_clean_frame(collection, overlap_id(last_id, overlap_seconds))
+    if not delta.empty:
+        last_id = max(last_id, delta['_id'].max())
+    delta = delta.drop(columns=['_id'])
+    if len(manifest['parts']) + 1 >= max_parts:
+        merged = dedupe_frame(concat_typed([read_snapshot(directory, manifest), delta]))
+        return write_snapshot(directory, merged.reset_index(drop=True), last_id, replace=True)
+    return write_snapshot(directory, delta, last_id)
+
+
+class IncrementalDataCache:
+    """
+    Process-wide cache of the cleaned dataset that refreshes by delta.
+
+    It remembers the largest MongoDB _id it has seen. A refresh only
+    aggregates documents inserted after that point, starting `overlap_seconds`
+    earlier to catch inserts that committed out of order. The delta is cleaned
+    by the same pipeline and merged into the cached frame with the same
+    de-duplication rules, so a refresh costs in proportion to the new rows.
+
+    If `snapshot_dir` holds a snapshot written by the collector, the frame is
+    read from it (memory-mapped from local disk) at start-up and whenever the
+    collector publishes a new one, and only the rows newer than the snapshot
+    come from MongoDB.
+    """
+
+    def __init__(self, collection, refresh_seconds=30, overlap_seconds=120, snapshot_dir=None):
+        self.collection = collection
+        self.refresh_seconds = refresh_seconds
+        self.overlap_seconds = overlap_seconds
+        self.snapshot_dir = snapshot_dir
+        self.snapshot_version = None
+        self.frame = None
+        self.version = 0  # Bumped whenever the frame changes; use it in cache keys
+        self.last_id = None
+        self.refreshed_at = 0.0
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        """Updates the frame and returns (how it was loaded, number of new rows)."""
+        manifest = read_manifest(self.snapshot_dir) if self.snapshot_dir else None
+        from_snapshot = bool(manifest and manifest['last_id']) and manifest['version'] != self.snapshot_version
+        if from_snapshot:
+            base, last_id = dedupe_frame(read_snapshot(self.snapshot_dir, manifest)), ObjectId(manifest['last_id'])
+            self.snapshot_version = manifest['version']
+            kind = "Snapshot load"
+        elif self.frame is None or self.last_id is None:
+            base, last_id, kind = None, None, "Full load"
+        else:
+            base, last_id, kind = self.frame, self.last_id, "Delta refresh"
+
+        if last_id is None:
+            df = fetch_clean_frame(self.collection)
+            if not df.empty:
+                last_id = df['_id'].max()
+            df = df.drop(columns=['_id'])
+        else:
+            delta = fetch_clean_frame(self.collection, overlap_id(last_id, self.overlap_seconds))
+            if not delta.empty:
+                last_id = max(last_id, delta['_id'].max())
+            df = base if delta.empty else dedupe_frame(concat_typed([base, delta.drop(columns=['_id'])]))
+
+        new_rows = len(df) - (0 if self.frame is None else len(self.frame))
+        if self.frame is None or base is not self.frame or new_rows:
+            self.frame = df.reset_index(drop=True)
+            self.version += 1
+        self.last_id = last_id
+        self.refreshed_at = time.monotonic()
+        return kind, new_rows
+
+    def get(self):
+        """Returns (frame, version), refreshing first if the frame is older than `refresh_seconds`."""
+        with self.lock:
+            if self.frame is None or time.monotonic() - self.refreshed_at >= self.refresh_seconds:
+                kind, new_rows = self.refresh()
+                print(f"{kind} at {datetime.now()}: {new_rows} new record(s), {len(self.frame)} in total.")
+                if kind != "Delta refresh":
+                    print(memory_report(self.frame))
+            return self.frame, self.version
+
+
+@st.cache_resource
+def get_db():
+    """Returns the database handle on the pooled client from db.py, shared by every session."""
+    return get_database()
+
+@st.cache_resource
+def get_data_cache():
+    """Creates the process-wide IncrementalDataCache from secrets."""
+    collection = get_disaster_collection(get_db())
+    return IncrementalDataCache(
+        collection,
+        refresh_seconds=float(st.secrets.get("DATA_REFRESH_SECONDS", 30)),
+        snapshot_dir=get_snapshot_dir(),
+    )
+
+def load_dataset():
+    """
+    Returns the shared (frame, version) pair. The frame is held once per
+    process and handed out without copying, so treat it as read-only:
+    filter or slice it, but add columns to your own copy. Copy-on-write
+    makes any accidental in-place change land on a private copy.
+    """
+    return get_data_cache().get()
 
-@st.cache_data(ttl=600)  # Cache the data for 10 minutes (600 seconds)
 def load_data():
     """
-    Connects to MongoDB using secrets, loads the data, cleans it,
-    and returns a pandas DataFrame.
-    """
-    # Load credentials from secrets
-    MONGO_URI = st.secrets["MONGO_URI"]
-    DB_NAME = st.secrets["DB_NAME"]
-    COLLECTION_NAME = st.secrets["COLLECTION_NAME"]
-    
-    # Connect to MongoDB
-    client = MongoClient(MONGO_URI)
-    db = client[DB_NAME]
-    collection = db[COLLECTION_NAME]
-    
-    # Load data and convert to DataFrame
-    df = pd.DataFrame(list(collection.find()))
-    
-    # --- Start of Centralized Cleaning Logic ---
-    df.drop(columns=['_id'], inplace=True, errors='ignore') # Drop mongo's _id
-    df.drop_duplicates(subset='title', inplace=True)
-    df['timestamp'] = pd.to_datetime(df['timestamp'], errors='coerce')
-    df.dropna(subset=['Latitude', 'Longitude', 'timestamp'], inplace=True)
-    
-    # Define locations and keywords to exclude
-    exclude_locations = ['world', 'global', 'international', 'reuters', 'associated press']
-    exclude_keywords_in_url = ['politics', 'yahoo', 'sports', 'entertainment']
-    exclude_keywords_in_title = ['tool', 'angry', 'market']
-    
-    df = df[~df['Location'].str.lower().isin(exclude_locations)]
-    df = df[~df['url'].str.lower().str.contains('|'.join(exclude_keywords_in_url))]
-    df = df[~df['title'].str.lower().str.contains('|'.join(exclude_keywords_in_title))]
-
-    df['date_only'] = df['timestamp'].dt.strftime('%Y-%m-%d')
-    df.drop_duplicates(subset=['date_only', 'disaster_event', 'Location'], inplace=True)
-    df.drop(columns=['date_only'], inplace=True)
-    # --- End of Cleaning Logic ---
-    
-    print(f"Data loaded and cleaned at {datetime.now()}. Found {len(df)} records.")
-    return df
\ No newline at end of file
+    Returns the cleaned disaster data as a pandas DataFrame in the compact
+    schema from schema.py (categorical text columns, float32 coordinates,
+    UTC timestamps, precomputed 'date'). The data is kept in a process-wide
+    cache that only fetches new documents from MongoDB when it refreshes
+    (every DATA_REFRESH_SECONDS). See load_dataset() for sharing rules.
+    """
+    return load_dataset()[0]
+
+@st.cache_resource(max_entries=2)
+def _build_query_engine(_frame, version):
+    return QueryEngine(_frame, version)
+
+def load_query_engine():
+    """
+    Returns the QueryEngine over the current dataset (see query.py). It is
+    built once per data version and shared by every session and page.
+    """
+    frame, version = load_dataset()
+    return _build_query_engine(frame, version)